@@ -0,0 +1,95 @@
+import argparse, random, sys
+
+
+class CorpusGenerator:
+    def __init__(self, count, depth=8, max_parents=3, fan_out=4, diamond_density=0.2, description_lines=4,
+                 comment_density=0.1, continuation_density=0.05, seed=0):
+        self.count = count
+        self.depth = max(1, min(depth, count))
+        self.max_parents = max_parents
+        self.fan_out = fan_out
+        self.diamond_density = diamond_density
+        self.description_lines = description_lines
+        self.comment_density = comment_density
+        self.continuation_density = continuation_density
+        self.random = random.Random(seed)
+
+    @staticmethod
+    def get_name(id):
+        return '(?x h_%d.n)' % id
+
+    def get_parent_ids(self):
+        starts = [level * self.count // self.depth for level in range(self.depth + 1)]
+        parent_ids = [list() for _ in range(self.count)]
+        primary_children = dict()
+        for level in range(1, self.depth):
+            previous = range(starts[level - 1], starts[level])
+            hubs = previous[:max(1, min(len(previous), round((starts[level + 1] - starts[level]) / self.fan_out)))]
+            for id in range(starts[level], starts[level + 1]):
+                primary = self.random.choice(hubs)
+                ids = [primary]
+                primary_children.setdefault(primary, list()).append(id)
+                for _ in range(self.random.randint(1, self.max_parents) - 1):
+                    siblings = primary_children.get(parent_ids[primary][0]) if parent_ids[primary] else hubs
+                    if self.random.random() < self.diamond_density and siblings:
+                        ids.append(self.random.choice(siblings))
+                    else:
+                        ids.append(self.random.randrange(starts[level]))
+                parent_ids[id] = list(dict.fromkeys(ids))
+        return parent_ids
+
+    def write(self, outfile):
+        parent_ids = self.get_parent_ids()
+        order = list(range(self.count))
+        self.random.shuffle(order)
+        for id in order:
+            outfile.write(self._get_block(id, parent_ids[id]))
+
+    def _get_block(self, id, parent_ids):
+        lines = ['obj-schema ' + self.get_name(id) + self._get_comment()]
+        if parent_ids:
+            lines.append('\t:types')
+            lines.extend(self._get_item('!t%d %s' % (index, self.get_name(parent_id))) for index, parent_id in enumerate(parent_ids))
+        if self.description_lines:
+            lines.append('\t:description_a')
+            lines.extend(self._get_item('!a%d (?x d_%d_%d.a)' % (index, id, index)) for index in range(self.description_lines))
+        if self.random.random() < self.comment_density:
+            lines.append('\t\t; comments')
+        return '\n'.join(lines) + '\n\n'
+
+    def _get_comment(self):
+        return '     ; comments' if self.random.random() < self.comment_density else ''
+
+    def _get_item(self, item):
+        if self.random.random() < self.continuation_density:
+            item = item.replace(' ', '\n\t\t  ', 1)
+        return '\t\t' + item + self._get_comment()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic obj-schema corpus')
+    parser.add_argument('-n', type=int, default=100000, help='Number of schemas. 100000 by default')
+    parser.add_argument('-o', type=str, default='-', help='Output file. stdout by default')
+    parser.add_argument('--depth', type=int, default=8, help='Number of hierarchy levels. 8 by default')
+    parser.add_argument('--max-parents', type=int, default=3, help='Maximum parents per schema. 3 by default')
+    parser.add_argument('--fan-out', type=float, default=4, help='Mean children per parent on the primary links. 4 by default')
+    parser.add_argument('--diamonds', type=float, default=0.2, help='Chance that an extra parent is a sibling of the first one. 0.2 by default')
+    parser.add_argument('--description-lines', type=int, default=4, help='Description items per schema. 4 by default')
+    parser.add_argument('--comments', type=float, default=0.1, help='Chance that a line carries a comment. 0.1 by default')
+    parser.add_argument('--continuations', type=float, default=0.05, help='Chance that an item wraps onto a continuation line. 0.05 by default')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed. 0 by default')
+    args = parser.parse_args()
+
+    generator = CorpusGenerator(
+        args.n, args.depth, args.max_parents, args.fan_out, args.diamonds, args.description_lines,
+        args.comments, args.continuations, args.seed,
+    )
+    if args.o == '-':
+        generator.write(sys.stdout)
+    else:
+        with open(args.o, 'w') as outfile:
+            generator.write(outfile)
+
+
+if __name__ == '__main__':
+    main()
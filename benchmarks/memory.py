@@ -0,0 +1,88 @@
+import argparse, array, json, os, random, sys, tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from schema import Graph, Schema, SchemaTable
+
+
+class LegacySchema:
+    def __init__(self, name):
+        self.name = name
+        self.types = list()
+        self.descriptions = dict()
+        self.parents = list()
+        self.children = list()
+        self.depth = 0
+        self.height = 0
+
+
+class MemoryBenchmark:
+    def __init__(self, count, max_parents, seed):
+        random.seed(seed)
+        self.names = ['(?x header_%d.n)' % id for id in range(count)]
+        self.parent_ids = [
+            sorted(random.sample(range(id), min(id, random.randint(1, max_parents)))) for id in range(count)
+        ]
+        self.types = [[self.names[parent_id] for parent_id in parent_ids] for parent_ids in self.parent_ids]
+
+    def run(self):
+        return {
+            'schemas': len(self.names),
+            'edges': sum(len(parent_ids) for parent_ids in self.parent_ids),
+            'legacy_bytes': self._measure(self._build_legacy),
+            'compact_bytes': self._measure(self._build_compact),
+        }
+
+    def _build_compact(self):
+        schemas = SchemaTable()
+        graph = Graph(schemas)
+        parent_offsets = array.array('i', [0])
+        parent_indices = array.array('i')
+        for id, name in enumerate(self.names):
+            schema = Schema(name)
+            schema.id = id
+            schema.graph = graph
+            schema.types = list(self.types[id])
+            schemas.append(schema)
+            parent_indices.extend(self.parent_ids[id])
+            parent_offsets.append(len(parent_indices))
+        graph.set_edges(parent_offsets, parent_indices)
+        return schemas
+
+    def _build_legacy(self):
+        schemas = list()
+        for id, name in enumerate(self.names):
+            schema = LegacySchema(name)
+            schema.types = list(self.types[id])
+            schemas.append(schema)
+        for schema, parent_ids in zip(schemas, self.parent_ids):
+            for parent_id in parent_ids:
+                schema.parents.append(schemas[parent_id])
+                schemas[parent_id].children.append(schema)
+        return schemas
+
+    def _measure(self, build):
+        tracemalloc.start()
+        model = build()
+        size, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del model
+        return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the memory of the legacy and compact schema graph models')
+    parser.add_argument('-n', type=int, default=100000, help='Number of schemas. 100000 by default')
+    parser.add_argument('--max-parents', type=int, default=3, help='Maximum parents per schema. 3 by default')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed. 0 by default')
+    args = parser.parse_args()
+
+    result = MemoryBenchmark(args.n, args.max_parents, args.seed).run()
+    result['legacy_bytes_per_schema'] = result['legacy_bytes'] / result['schemas']
+    result['compact_bytes_per_schema'] = result['compact_bytes'] / result['schemas']
+    result['ratio'] = result['legacy_bytes'] / result['compact_bytes']
+    json.dump(result, sys.stdout, indent=2)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
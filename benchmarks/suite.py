@@ -0,0 +1,173 @@
+import argparse, json, os, platform, random, subprocess, sys, tempfile, time, tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from generate import CorpusGenerator
+from schema import CycleError, FamilyView, File, SearchIndex, Struct, Topology
+
+ANCESTRY_PAIRS = 10000
+
+
+class SuiteBenchmark:
+    def __init__(self, path, samples=50, seed=0, font_size=20):
+        self.path = path
+        self.samples = samples
+        self.seed = seed
+        self.font_size = font_size
+        self.skipped = list()
+
+    def run(self, is_traced=False):
+        results = dict()
+        schemas = self._measure(results, 'parse', is_traced, lambda: list(File(self.path).get_schemas()))
+        struct = self._measure(results, 'struct', is_traced, lambda: Struct(schemas))
+        self._measure(results, 'levels', is_traced, lambda: self._get_levels(struct))
+        sample = random.Random(self.seed).sample(list(struct.schemas), min(self.samples, len(struct.schemas)))
+        self._measure(results, 'ancestry', is_traced, lambda: self._get_ancestry(struct))
+        families = self._measure(results, 'family', is_traced, lambda: self._get_families(sample))
+        self._measure(results, 'sort', is_traced, lambda: [family._sort() for family in families])
+        index = self._measure(results, 'search_index', is_traced, lambda: SearchIndex(struct.name_schema_map))
+        self._measure(results, 'search', is_traced, lambda: self._search(index, sample))
+        try:
+            from layout import TextMetrics, TreeLayout
+        except ImportError:
+            self.skipped = ['layout']
+            return results
+        text_metrics = TextMetrics(os.path.join(ROOT, 'Montserrat-Medium.ttf'), self.font_size)
+        self._measure(results, 'layout', is_traced, lambda: [TreeLayout(family, text_metrics, self.font_size) for family in families])
+        return results
+
+    def _get_ancestry(self, struct):
+        generator = random.Random(self.seed)
+        schemas = list(struct.schemas)
+        return sum(generator.choice(schemas).is_ancestor_of(generator.choice(schemas)) for _ in range(ANCESTRY_PAIRS))
+
+    def _get_families(self, schemas):
+        families = list()
+        for schema in schemas:
+            try:
+                families.append(FamilyView(schema))
+            except CycleError:
+                pass
+        return families
+
+    def _get_levels(self, struct):
+        topology = Topology([schema.id for schema in struct.schemas], struct.graph.get_parent_ids, struct.graph.get_child_ids)
+        return topology.get_depths(), topology.get_heights()
+
+    def _measure(self, results, stage, is_traced, function):
+        if is_traced:
+            tracemalloc.start()
+        start = time.perf_counter()
+        value = function()
+        seconds = time.perf_counter() - start
+        if is_traced:
+            results[stage] = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+        else:
+            results[stage] = seconds
+        return value
+
+    def _search(self, index, schemas):
+        for schema in schemas:
+            key = schema.name[schema.name.find(' ') + 1:-3]
+            index.search(key[:4], limit=50)
+            index.search(key, 'prefix', 50)
+            index.search(key.replace('_', ' '), 'token', 50)
+
+
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_corpus(work_dir, size, options):
+    name = 'corpus-' + '-'.join(str(value) for value in [size, *options.values()]) + '.txt'
+    path = os.path.join(work_dir, name)
+    if not os.path.exists(path):
+        with open(path + '.tmp', 'w') as outfile:
+            CorpusGenerator(size, **options).write(outfile)
+        os.replace(path + '.tmp', path)
+    return path
+
+
+def compare(baseline, results, threshold):
+    baseline_seconds = {(row['size'], row['stage']): row['seconds'] for row in baseline['results']}
+    regressions = 0
+    for row in results:
+        previous = baseline_seconds.get((row['size'], row['stage']))
+        if not previous:
+            continue
+        ratio = row['seconds'] / previous
+        is_regression = ratio > 1 + threshold and row['seconds'] - previous > 0.01
+        regressions += is_regression
+        sys.stderr.write('%8d %-12s %10.4f %10.4f %6.2fx%s\n' % (
+            row['size'], row['stage'], previous, row['seconds'], ratio, ' REGRESSION' if is_regression else ''))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time and memory-profile the schema pipeline on synthetic corpora')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='Schema counts. 1000 10000 100000 by default')
+    parser.add_argument('--repeat', type=int, default=1, help='Runs per size, the fastest is kept. 1 by default')
+    parser.add_argument('--memory', action='store_true', help='Also record the peak traced memory of every stage in a separate run')
+    parser.add_argument('--samples', type=int, default=50, help='Schemas used for family, sort, search and layout. 50 by default')
+    parser.add_argument('--work-dir', type=str, required=False, help='Directory that keeps generated corpora between runs')
+    parser.add_argument('--output', type=str, default='-', help='Results file. stdout by default')
+    parser.add_argument('--baseline', type=str, required=False, help='Earlier results to compare against. Exits 1 on regressions')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Slowdown ratio counted as a regression. 0.2 by default')
+    parser.add_argument('--depth', type=int, default=8, help='Number of hierarchy levels. 8 by default')
+    parser.add_argument('--max-parents', type=int, default=3, help='Maximum parents per schema. 3 by default')
+    parser.add_argument('--fan-out', type=float, default=4, help='Mean children per parent on the primary links. 4 by default')
+    parser.add_argument('--diamonds', type=float, default=0.2, help='Chance that an extra parent is a sibling of the first one. 0.2 by default')
+    parser.add_argument('--description-lines', type=int, default=4, help='Description items per schema. 4 by default')
+    parser.add_argument('--comments', type=float, default=0.1, help='Chance that a line carries a comment. 0.1 by default')
+    parser.add_argument('--continuations', type=float, default=0.05, help='Chance that an item wraps onto a continuation line. 0.05 by default')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed. 0 by default')
+    args = parser.parse_args()
+
+    options = {
+        'depth': args.depth, 'max_parents': args.max_parents, 'fan_out': args.fan_out, 'diamond_density': args.diamonds,
+        'description_lines': args.description_lines, 'comment_density': args.comments,
+        'continuation_density': args.continuations, 'seed': args.seed,
+    }
+    report = {
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'generator': options,
+        'samples': args.samples,
+        'skipped': list(),
+        'results': list(),
+    }
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_dir = args.work_dir or temp_dir
+        os.makedirs(work_dir, exist_ok=True)
+        for size in args.sizes:
+            benchmark = SuiteBenchmark(get_corpus(work_dir, size, options), args.samples, args.seed)
+            runs = [benchmark.run() for _ in range(max(1, args.repeat))]
+            peaks = benchmark.run(is_traced=True) if args.memory else dict()
+            report['skipped'] = benchmark.skipped
+            for stage in runs[0]:
+                row = {'size': size, 'stage': stage, 'seconds': min(run[stage] for run in runs)}
+                if stage in peaks:
+                    row['peak_bytes'] = peaks[stage]
+                report['results'].append(row)
+            sys.stderr.write('Benchmarked: %d schemas\n' % size)
+
+    if args.output == '-':
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write('\n')
+    else:
+        with open(args.output, 'w') as outfile:
+            json.dump(report, outfile, indent=2)
+            outfile.write('\n')
+    if args.baseline:
+        with open(args.baseline) as infile:
+            return 1 if compare(json.load(infile), report['results'], args.threshold) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,259 @@
+import array, hashlib, logging, mmap, os, struct, tempfile
+
+from instrument import measure
+from schema import *
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'SHGC'
+VERSION = 6
+SECTIONS = (
+    'names', 'type_offsets', 'types', 'parent_offsets', 'parents', 'child_offsets', 'children', 'depths', 'heights',
+    'missing_names', 'missing_offsets', 'missing_children', 'cycle',
+    'description_schema_offsets', 'description_block_starts', 'description_block_ends',
+    'description_header_offsets', 'diagnostics',
+)
+RECORD_SEPARATOR = '\x1f'
+HEADER = struct.Struct('<4sIQQ32s32sI' + 'QQ' * len(SECTIONS))
+DIGEST_END = struct.calcsize('<4sIQQ32s32s')
+
+
+class StructCache:
+    def __init__(self, source, cache_dir=None):
+        self.source = source
+        self.cache_dir = cache_dir or os.path.join(
+            os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'schema-hierarchy-generator')
+        self.mmap = None
+        self.file = None
+
+    def get_path(self):
+        key = hashlib.sha1(os.path.abspath(self.source).encode()).hexdigest()
+        return os.path.join(self.cache_dir, key + '.bin')
+
+    def get_struct(self):
+        if not self._is_cacheable():
+            self.file = File(self.source)
+            return Struct(self.file.get_schemas(), diagnostics=self.file.diagnostics)
+        struct = self.load()
+        if struct is None:
+            stat = os.stat(self.source)
+            self.file = File(self.source)
+            struct = Struct(self.file.get_schemas(), diagnostics=self.file.diagnostics)
+            self.save(struct, stat)
+        return struct
+
+    @measure('cache.load')
+    def load(self):
+        try:
+            with open(self.get_path(), 'rb') as infile:
+                buffer = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        try:
+            header = HEADER.unpack_from(buffer)
+            if not self._is_valid(header):
+                logger.info('CacheStale: ' + self.get_path())
+                return None
+            if self._get_digest([memoryview(buffer)[DIGEST_END:]]) != header[5]:
+                raise ValueError('digest mismatch')
+            sections = dict(zip(SECTIONS, zip(header[7::2], header[8::2])))
+            loaded = self._get_struct(buffer, sections, header[6])
+        except (struct.error, ValueError, IndexError, TypeError, UnicodeDecodeError) as error:
+            logger.warning('CacheCorrupt: ' + self.get_path() + ' ' + str(error))
+            return None
+        self.mmap = buffer
+        return loaded
+
+    @measure('cache.save')
+    def save(self, struct, stat):
+        if not self._is_unchanged(stat):
+            return
+        schemas = list(struct.schemas)
+        if any(schema.description_store is None or schema.description_store.path != self.source for schema in schemas):
+            return
+        if any(store is None or store.path != self.source for diagnostic in struct.diagnostics for store, _ in diagnostic.sources):
+            return
+        indices = {schema.id: index for index, schema in enumerate(schemas)}
+        missing = list(struct.missing_parent_map.items())
+        blocks = [schema.description_store.get_blocks(schema.description_index) for schema in schemas]
+        types = ['\n'.join(schema.types).encode() for schema in schemas]
+        sections = {
+            'names': '\n'.join([schema.name for schema in schemas]).encode(),
+            'type_offsets': self._get_offsets([len(schema_types) for schema_types in types], 'Q'),
+            'types': b''.join(types),
+            'parent_offsets': self._get_offsets([len(schema.get_parent_ids()) for schema in schemas], 'I'),
+            'parents': array.array('I', [indices[id] for schema in schemas for id in schema.get_parent_ids()]),
+            'child_offsets': self._get_offsets([len(schema.get_child_ids()) for schema in schemas], 'I'),
+            'children': array.array('I', [indices[id] for schema in schemas for id in schema.get_child_ids()]),
+            'depths': array.array('I', [schema.depth for schema in schemas]),
+            'heights': array.array('I', [schema.height for schema in schemas]),
+            'missing_names': '\n'.join([name for name, _ in missing]).encode(),
+            'missing_offsets': self._get_offsets([len(children) for _, children in missing], 'I'),
+            'missing_children': array.array('I', [indices[child.id] for _, children in missing for child in children]),
+            'cycle': array.array('I', [indices[struct.get_schema_by_name(name).id] for name in struct.cycle]),
+            'description_schema_offsets': self._get_offsets([len(schema_blocks) for schema_blocks in blocks], 'Q'),
+            'description_block_starts': array.array('Q', [start for schema_blocks in blocks for start, _ in schema_blocks]),
+            'description_block_ends': array.array('Q', [end for schema_blocks in blocks for _, end in schema_blocks]),
+            'description_header_offsets': array.array('Q', [self._get_header_offset(schema) for schema in schemas]),
+            'diagnostics': '\n'.join([self._get_diagnostic_record(diagnostic) for diagnostic in struct.diagnostics]).encode(),
+        }
+        try:
+            self._write(sections, len(schemas), stat)
+        except OSError as error:
+            logger.warning('CacheNotWritten: ' + str(error))
+
+    def _get_diagnostic(self, record, store):
+        code, severity, name, detail, offsets = record.split(RECORD_SEPARATOR)
+        return Diagnostic(code, severity, name, detail, [(store, int(offset)) for offset in offsets.split()])
+
+    def _get_diagnostic_record(self, diagnostic):
+        offsets = ' '.join(str(store.get_offset(offset)) for store, offset in diagnostic.sources)
+        return RECORD_SEPARATOR.join([diagnostic.code, diagnostic.severity, diagnostic.name, diagnostic.detail, offsets])
+
+    def _get_digest(self, parts):
+        blake2b = hashlib.blake2b(digest_size=32)
+        for part in parts:
+            blake2b.update(part)
+        return blake2b.digest()
+
+    def _get_hash(self):
+        sha256 = hashlib.sha256()
+        with open(self.source, 'rb') as infile:
+            for chunk in iter(lambda: infile.read(1 << 20), b''):
+                sha256.update(chunk)
+        return sha256.digest()
+
+    def _get_header_offset(self, schema):
+        store = schema.description_store
+        return store.get_offset(store.header_offsets[schema.description_index])
+
+    def _get_offsets(self, lengths, typecode):
+        offsets = array.array(typecode, [0])
+        for length in lengths:
+            offsets.append(offsets[-1] + length)
+        return offsets
+
+    def _get_strings(self, buffer, section, count):
+        start, length = section
+        strings = bytes(buffer[start:start + length]).decode().split('\n')
+        if len(strings) != count and not (count == 0 and strings == ['']):
+            raise ValueError('string count mismatch')
+        return strings if count else list()
+
+    def _get_schema(self, arrays, names, store, index):
+        schema = Schema(names[index])
+        start, end = arrays['type_offsets'][index], arrays['type_offsets'][index + 1]
+        if end > start:
+            schema.types = bytes(arrays['types'][start:end]).decode().split('\n')
+        schema.depth = arrays['depths'][index]
+        schema.height = arrays['heights'][index]
+        schema.description_store = store
+        schema.description_index = index
+        return schema
+
+    def _get_struct(self, buffer, sections, count):
+        view = memoryview(buffer)
+        arrays = dict()
+        for name in (
+            'parent_offsets', 'parents', 'child_offsets', 'children', 'depths', 'heights',
+            'missing_offsets', 'missing_children', 'cycle',
+        ):
+            start, length = sections[name]
+            arrays[name] = view[start:start + length].cast('I')
+        stat = os.stat(self.source)
+        store = DescriptionStore(self.source, stat.st_size, stat.st_mtime_ns)
+        for name in (
+            'type_offsets', 'description_schema_offsets', 'description_block_starts', 'description_block_ends',
+            'description_header_offsets',
+        ):
+            start, length = sections[name]
+            arrays[name] = view[start:start + length].cast('Q')
+        start, length = sections['types']
+        arrays['types'] = view[start:start + length]
+        store.schema_offsets = arrays['description_schema_offsets']
+        store.block_starts = arrays['description_block_starts']
+        store.block_ends = arrays['description_block_ends']
+        store.header_offsets = arrays['description_header_offsets']
+        if any(len(arrays[name]) != count + 1 for name in (
+            'type_offsets', 'parent_offsets', 'child_offsets', 'description_schema_offsets',
+        )):
+            raise ValueError('offset count mismatch')
+        if any(len(arrays[name]) != count for name in ('depths', 'heights', 'description_header_offsets')):
+            raise ValueError('section length mismatch')
+        if arrays['type_offsets'][count] != length or arrays['parent_offsets'][count] != len(arrays['parents']):
+            raise ValueError('offset count mismatch')
+        if arrays['child_offsets'][count] != len(arrays['children']) or len(arrays['children']) != len(arrays['parents']):
+            raise ValueError('edge count mismatch')
+        if len(store.block_starts) != len(store.block_ends) or store.schema_offsets[count] != len(store.block_starts):
+            raise ValueError('description block count mismatch')
+        if any(max(arrays[name], default=0) >= count for name in ('parents', 'children', 'missing_children', 'cycle')):
+            raise ValueError('schema index out of range')
+
+        names = self._get_strings(buffer, sections['names'], count)
+        struct = Struct((), linked=True)
+        struct.add_unloaded_schemas(names, lambda index: self._get_schema(arrays, names, store, index))
+        struct.graph.set_edges(arrays['parent_offsets'], arrays['parents'], arrays['child_offsets'], arrays['children'])
+        missing_offsets, missing_children = arrays['missing_offsets'], arrays['missing_children']
+        missing_names = self._get_strings(buffer, sections['missing_names'], len(missing_offsets) - 1)
+        for index, name in enumerate(missing_names):
+            children = missing_children[missing_offsets[index]:missing_offsets[index + 1]]
+            struct.missing_parent_map[name] = [struct.id_schema_map[child] for child in children]
+        struct.cycle = [names[index] for index in arrays['cycle']]
+        if not struct.cycle:
+            struct.graph.reachability = Reachability(struct.graph, array.array('i', arrays['depths']))
+        start, length = sections['diagnostics']
+        records = bytes(buffer[start:start + length]).decode().split('\n') if length else list()
+        struct.diagnostics = [self._get_diagnostic(record, store) for record in records]
+        return struct
+
+    def _is_cacheable(self):
+        return isinstance(self.source, (str, os.PathLike)) and self.source != '-' and os.path.isfile(self.source)
+
+    def _is_unchanged(self, stat):
+        current = os.stat(self.source)
+        return (current.st_size, current.st_mtime_ns) == (stat.st_size, stat.st_mtime_ns)
+
+    def _is_valid(self, header):
+        magic, version, size, mtime_ns, sha256 = header[:5]
+        if magic != MAGIC or version != VERSION:
+            return False
+        stat = os.stat(self.source)
+        if stat.st_size != size:
+            return False
+        if stat.st_mtime_ns != mtime_ns:
+            if self._get_hash() != sha256:
+                return False
+            self._write_header(header[:3] + (stat.st_mtime_ns,) + header[4:])
+        return True
+
+    def _write(self, sections, count, stat):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        parts = list()
+        table = list()
+        offset = HEADER.size
+        for name in SECTIONS:
+            data = sections[name]
+            parts.append(bytes(-offset % 8))
+            parts.append(data.tobytes() if isinstance(data, array.array) else data)
+            offset += len(parts[-2])
+            table.extend([offset, len(parts[-1])])
+            offset += len(parts[-1])
+        header = [MAGIC, VERSION, stat.st_size, stat.st_mtime_ns, self._get_hash(), bytes(32), count, *table]
+        header[5] = self._get_digest([HEADER.pack(*header)[DIGEST_END:], *parts])
+        handle, temp_path = tempfile.mkstemp(dir=self.cache_dir)
+        try:
+            with os.fdopen(handle, 'wb') as outfile:
+                outfile.write(HEADER.pack(*header))
+                outfile.writelines(parts)
+            os.replace(temp_path, self.get_path())
+        except OSError:
+            os.unlink(temp_path)
+            raise
+
+    def _write_header(self, header):
+        try:
+            with open(self.get_path(), 'r+b') as outfile:
+                outfile.write(HEADER.pack(*header))
+        except OSError as error:
+            logger.warning('CacheNotWritten: ' + str(error))
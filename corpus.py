@@ -0,0 +1,100 @@
+import concurrent.futures, errno, glob, os
+
+from cache import StructCache
+from instrument import measure
+from schema import *
+
+
+class Corpus:
+    def __init__(self, sources, use_cache=True, max_workers=None):
+        self.sources = [sources] if isinstance(sources, (str, os.PathLike)) else list(sources)
+        self.use_cache = use_cache
+        self.max_workers = max_workers
+        self.paths = list()
+        self.size = 0
+        self.parsed_size = 0
+        self.cache = None
+        self.file = None
+        self.diagnostics = list()
+
+    @staticmethod
+    def get_paths(sources):
+        paths = list()
+        for source in sources:
+            if source == '-' or os.path.isfile(source):
+                paths.append(source)
+            elif os.path.isdir(source):
+                paths.extend(sorted(
+                    os.path.join(root, name)
+                    for root, _, names in os.walk(source)
+                    for name in names if name.endswith('.txt')
+                ))
+            else:
+                matches = [path for path in sorted(glob.glob(source, recursive=True)) if os.path.isfile(path)]
+                if not matches:
+                    raise FileNotFoundError(errno.ENOENT, 'No schema files found', source)
+                paths.extend(matches)
+        if not paths:
+            raise FileNotFoundError(errno.ENOENT, 'No schema files found', ' '.join(map(str, sources)))
+        return list(dict.fromkeys(paths))
+
+    @staticmethod
+    def parse(path):
+        file = File(path)
+        rows = [(schema.name, schema.types, schema.description_index) for schema in file.get_schemas()]
+        return rows, file.description_store, file.diagnostics
+
+    def get_progress(self):
+        file = self.cache.file if self.cache is not None else self.file
+        offset = file.offset if file is not None else self.parsed_size
+        return min(offset / self.size, 1) if self.size else 0
+
+    @measure('corpus')
+    def get_struct(self):
+        self.paths = self.get_paths(self.sources)
+        self.size = sum(os.path.getsize(path) for path in self.paths if path != '-')
+        if len(self.paths) == 1:
+            if self.use_cache:
+                self.cache = StructCache(self.paths[0])
+                return self.cache.get_struct()
+            self.file = File(self.paths[0])
+            return Struct(self.file.get_schemas(), diagnostics=self.file.diagnostics)
+
+        schema_lists = list()
+        with concurrent.futures.ProcessPoolExecutor(self.max_workers) as executor:
+            futures = [None if path == '-' else executor.submit(self.parse, path) for path in self.paths]
+            for path, future in zip(self.paths, futures):
+                schema_lists.append(self._get_stdin_schemas() if future is None else self._get_schemas(*future.result()))
+                self.parsed_size += 0 if path == '-' else os.path.getsize(path)
+        return Struct(self._merge(schema_lists), diagnostics=self.diagnostics)
+
+    def _get_schemas(self, rows, store, diagnostics):
+        self.diagnostics.extend(diagnostics)
+        schemas = list()
+        for name, types, description_index in rows:
+            schema = Schema(name)
+            schema.types = types
+            schema.description_store = store
+            schema.description_index = description_index
+            schemas.append(schema)
+        return schemas
+
+    def _get_source(self, schema):
+        store = schema.description_store
+        return store, store.header_offsets[schema.description_index] if store is not None else None
+
+    def _get_stdin_schemas(self):
+        file = File('-')
+        schemas = list(file.get_schemas())
+        self.diagnostics.extend(file.diagnostics)
+        return schemas
+
+    def _merge(self, schema_lists):
+        name_schema_map = dict()
+        for schemas in schema_lists:
+            for schema in schemas:
+                first = name_schema_map.setdefault(schema.name, schema)
+                if first is not schema:
+                    sources = [self._get_source(first), self._get_source(schema)]
+                    self.diagnostics.append(Diagnostic('DuplicateHeader', ERROR, schema.name, '', sources))
+        return name_schema_map.values()
@@ -0,0 +1,202 @@
+import array, collections, hashlib, os
+
+from corpus import Corpus
+from instrument import measure
+from schema import *
+
+
+DIGEST_SIZE = 8
+
+
+class Snapshot:
+    def __init__(self, sources, names, ids):
+        self.sources = [sources] if isinstance(sources, (str, os.PathLike)) else list(sources)
+        self.names = names
+        self.ids = ids
+        self.positions = array.array('i')
+        self.schema_ids = array.array('i')
+        self.fingerprints = bytearray()
+        self.type_offsets = array.array('q', [0])
+        self.type_ids = array.array('i')
+        self.parent_offsets = array.array('q', [0])
+        self.parent_ids = array.array('i')
+
+    def get_fingerprint(self, id):
+        position = self.positions[id]
+        return self.fingerprints[position * 2 * DIGEST_SIZE:(position + 1) * 2 * DIGEST_SIZE]
+
+    def get_parent_ids(self, id):
+        position = self.positions[id]
+        return [parent_id for parent_id in self.parent_ids[self.parent_offsets[position]:self.parent_offsets[position + 1]] if self.has(parent_id)]
+
+    def get_type_ids(self, id):
+        position = self.positions[id]
+        return self.type_ids[self.type_offsets[position]:self.type_offsets[position + 1]]
+
+    def has(self, id):
+        return id < len(self.positions) and self.positions[id] >= 0
+
+    @measure('diff.load')
+    def load(self):
+        for path in Corpus.get_paths(self.sources):
+            for schema in File(path, lazy=False).get_schemas():
+                self._add(schema)
+        return self
+
+    def _add(self, schema):
+        id = self._get_id(schema.name)
+        if self.has(id):
+            return
+        if id >= len(self.positions):
+            self.positions.extend([-1] * (id + 1 - len(self.positions)))
+        self.positions[id] = len(self.schema_ids)
+        self.schema_ids.append(id)
+        self.fingerprints += self._get_digest('\n'.join(schema.types)) + self._get_digest('\n\n'.join(
+            '\n'.join([key, *items]) for key, items in sorted(schema.descriptions.items())))
+        self.type_ids.extend([self._get_id(type) for type in schema.types])
+        self.type_offsets.append(len(self.type_ids))
+        self.parent_ids.extend([self._get_id(name) for name in schema.get_parent_names_from_types()])
+        self.parent_offsets.append(len(self.parent_ids))
+
+    def _get_digest(self, text):
+        return hashlib.blake2b(text.encode(), digest_size=DIGEST_SIZE).digest()
+
+    def _get_id(self, name):
+        id = self.ids.get(name)
+        if id is None:
+            id = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return id
+
+
+class Differ:
+    def __init__(self, old_sources, new_sources):
+        self.names = list()
+        self.ids = dict()
+        self.old = Snapshot(old_sources, self.names, self.ids)
+        self.new = Snapshot(new_sources, self.names, self.ids)
+        self.added = array.array('i')
+        self.removed = array.array('i')
+        self.changed_types = array.array('i')
+        self.changed_descriptions = array.array('i')
+        self.added_edges = array.array('i')
+        self.removed_edges = array.array('i')
+        self.affected = array.array('i')
+
+    def get_report(self):
+        names = self.names
+        return {
+            'old_schemas': len(self.old.schema_ids),
+            'new_schemas': len(self.new.schema_ids),
+            'added': [names[id] for id in self.added],
+            'removed': [names[id] for id in self.removed],
+            'changed_types': [
+                {'name': names[id], 'added_types': added, 'removed_types': removed}
+                for id, added, removed in self._get_type_changes()
+            ],
+            'changed_descriptions': [names[id] for id in self.changed_descriptions],
+            'added_edges': [{'parent': names[parent], 'child': names[child]} for parent, child in self._get_edges(self.added_edges)],
+            'removed_edges': [{'parent': names[parent], 'child': names[child]} for parent, child in self._get_edges(self.removed_edges)],
+            'affected': [names[id] for id in self.affected],
+        }
+
+    def get_rows(self):
+        names = self.names
+        yield from (['added', names[id], ''] for id in self.added)
+        yield from (['removed', names[id], ''] for id in self.removed)
+        for id, added, removed in self._get_type_changes():
+            yield from (['type_added', names[id], type] for type in added)
+            yield from (['type_removed', names[id], type] for type in removed)
+        yield from (['description_changed', names[id], ''] for id in self.changed_descriptions)
+        yield from (['edge_added', names[child], names[parent]] for parent, child in self._get_edges(self.added_edges))
+        yield from (['edge_removed', names[child], names[parent]] for parent, child in self._get_edges(self.removed_edges))
+        yield from (['affected', names[id], ''] for id in self.affected)
+
+    def has_changes(self):
+        return bool(self.added or self.removed or self.changed_types or self.changed_descriptions or self.added_edges or self.removed_edges)
+
+    @measure('diff')
+    def run(self):
+        self.old.load()
+        self.new.load()
+        self._compare()
+        self._set_affected()
+        return self.has_changes()
+
+    def _compare(self):
+        for id in range(len(self.names)):
+            in_old, in_new = self.old.has(id), self.new.has(id)
+            if not in_old and not in_new:
+                continue
+            if in_old != in_new:
+                (self.added if in_new else self.removed).append(id)
+            else:
+                old_fingerprint, new_fingerprint = self.old.get_fingerprint(id), self.new.get_fingerprint(id)
+                if old_fingerprint[:DIGEST_SIZE] != new_fingerprint[:DIGEST_SIZE]:
+                    self.changed_types.append(id)
+                if old_fingerprint[DIGEST_SIZE:] != new_fingerprint[DIGEST_SIZE:]:
+                    self.changed_descriptions.append(id)
+            old_parent_ids = self.old.get_parent_ids(id) if in_old else list()
+            new_parent_ids = self.new.get_parent_ids(id) if in_new else list()
+            if old_parent_ids != new_parent_ids:
+                old_set, new_set = set(old_parent_ids), set(new_parent_ids)
+                for parent_id in dict.fromkeys(new_parent_ids):
+                    if parent_id not in old_set:
+                        self.added_edges.extend([parent_id, id])
+                for parent_id in dict.fromkeys(old_parent_ids):
+                    if parent_id not in new_set:
+                        self.removed_edges.extend([parent_id, id])
+
+    def _get_child_ids(self):
+        offsets = array.array('q', [0]) * (len(self.names) + 1)
+        for snapshot in (self.old, self.new):
+            for id in snapshot.schema_ids:
+                for parent_id in snapshot.get_parent_ids(id):
+                    offsets[parent_id + 1] += 1
+        for id in range(len(self.names)):
+            offsets[id + 1] += offsets[id]
+        child_ids = array.array('i', [0]) * offsets[-1]
+        ends = array.array('q', offsets[:-1])
+        for snapshot in (self.old, self.new):
+            for id in snapshot.schema_ids:
+                for parent_id in snapshot.get_parent_ids(id):
+                    child_ids[ends[parent_id]] = id
+                    ends[parent_id] += 1
+        return lambda id: child_ids[offsets[id]:offsets[id + 1]]
+
+    def _get_edges(self, edges):
+        return zip(edges[::2], edges[1::2])
+
+    def _get_parent_ids(self, id):
+        return [
+            *(self.old.get_parent_ids(id) if self.old.has(id) else ()),
+            *(self.new.get_parent_ids(id) if self.new.has(id) else ()),
+        ]
+
+    def _get_reached(self, seeds, get_relative_ids):
+        reached = bytearray(len(self.names))
+        for id in seeds:
+            reached[id] = 1
+        queue = collections.deque(seeds)
+        while queue:
+            for relative_id in get_relative_ids(queue.popleft()):
+                if not reached[relative_id]:
+                    reached[relative_id] = 1
+                    queue.append(relative_id)
+        return reached
+
+    def _get_type_changes(self):
+        names = self.names
+        for id in self.changed_types:
+            old_types = [names[type_id] for type_id in self.old.get_type_ids(id)]
+            new_types = [names[type_id] for type_id in self.new.get_type_ids(id)]
+            old_set, new_set = set(old_types), set(new_types)
+            yield id, [type for type in new_types if type not in old_set], [type for type in old_types if type not in new_set]
+
+    def _set_affected(self):
+        seeds = self.added + self.removed + self.changed_types
+        if not seeds:
+            return
+        ancestors = self._get_reached(seeds, self._get_parent_ids)
+        descendants = self._get_reached(seeds, self._get_child_ids())
+        self.affected = array.array('i', [id for id in range(len(self.names)) if ancestors[id] or descendants[id]])
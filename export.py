@@ -0,0 +1,124 @@
+import collections, concurrent.futures, hashlib, math, multiprocessing, os, re
+from xml.sax.saxutils import escape
+
+from PIL import Image, ImageDraw
+
+from corpus import Corpus
+from instrument import measure
+from layout import TextMetrics, TreeLayout
+from schema import *
+
+
+FONT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Montserrat-Medium.ttf')
+CENTER_COLOR = '#ffff00'
+EXPORT_CHUNK_SIZE = 16
+
+
+class Exporter:
+    current = None
+
+    def __init__(self, struct, sources=None, use_cache=True, font_size=20, level_spacing=100, font=FONT_PATH):
+        self.struct = struct
+        self.sources = sources
+        self.use_cache = use_cache
+        self.font_size = font_size
+        self.level_spacing = level_spacing
+        self.font = font
+        self.text_metrics = TextMetrics(font, font_size)
+
+    @staticmethod
+    def get_file_name(name, format, is_hashed=False):
+        base = re.sub('[^0-9A-Za-z.-]+', '_', name).strip('_')
+        if is_hashed or not base:
+            base = (base + '-' if base else '') + hashlib.blake2b(name.encode(), digest_size=4).hexdigest()
+        return base + '.' + format
+
+    @classmethod
+    def get_file_names(cls, names, format):
+        file_names = {name: cls.get_file_name(name, format) for name in names}
+        counts = collections.Counter(file_name.lower() for file_name in file_names.values())
+        return [cls.get_file_name(name, format, counts[file_names[name].lower()] > 1) for name in names]
+
+    def export(self, name, path):
+        tree = self.get_tree(name)
+        if path.endswith('.png'):
+            self.get_image(tree).save(path)
+            return path
+        with open(path, 'w', encoding='utf-8') as outfile:
+            outfile.write(self.get_svg(tree))
+        return path
+
+    def export_all(self, names, output_dir, format='svg', max_workers=None):
+        os.makedirs(output_dir, exist_ok=True)
+        paths = [os.path.join(output_dir, file_name) for file_name in self.get_file_names(names, format)]
+        if max_workers == 1 or len(names) <= EXPORT_CHUNK_SIZE:
+            return [self._export(name, path) for name, path in zip(names, paths)]
+        Exporter.current = self
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork') if 'fork' in methods else None
+        options = (self.sources, self.use_cache, self.font_size, self.level_spacing, self.font)
+        with concurrent.futures.ProcessPoolExecutor(max_workers, mp_context=context, initializer=self._init_worker, initargs=options) as executor:
+            return list(executor.map(self._export_in_worker, names, paths, chunksize=EXPORT_CHUNK_SIZE))
+
+    @measure('render.png')
+    def get_image(self, tree):
+        image = Image.new('RGB', (math.ceil(tree.width), math.ceil(tree.height)), 'white')
+        draw = ImageDraw.Draw(image)
+        for start, end in self._get_edge_points(tree):
+            draw.line([start, end], fill='black', width=1)
+        for key, (x, y, width, height) in tree.rects.items():
+            top = tree.height - y - height
+            if key == tree.family.schema.name:
+                draw.rectangle([x, top, x + width, top + height], fill=CENTER_COLOR)
+            draw.text((x + width / 2, top + height / 2), tree.labels[key], fill='black', font=self.text_metrics.font, anchor='mm')
+        return image
+
+    @measure('render.svg')
+    def get_svg(self, tree):
+        lines = [
+            '<svg xmlns="http://www.w3.org/2000/svg" width="%.1f" height="%.1f" viewBox="0 0 %.1f %.1f">' % ((tree.width, tree.height) * 2),
+            '<rect width="100%" height="100%" fill="white"/>',
+            '<g stroke="black" stroke-width="1">',
+        ]
+        lines.extend('<line x1="%.1f" y1="%.1f" x2="%.1f" y2="%.1f"/>' % (*start, *end) for start, end in self._get_edge_points(tree))
+        lines.append('</g>')
+        x, y, width, height = tree.rects[tree.family.schema.name]
+        lines.append('<rect x="%.1f" y="%.1f" width="%.1f" height="%.1f" fill="%s"/>' % (x, tree.height - y - height, width, height, CENTER_COLOR))
+        lines.append('<g font-family="Montserrat, sans-serif" font-size="%d" text-anchor="middle" dominant-baseline="central">' % self.font_size)
+        for key, (x, y, width, height) in tree.rects.items():
+            lines.append('<text x="%.1f" y="%.1f">%s</text>' % (x + width / 2, tree.height - y - height / 2, escape(tree.labels[key])))
+        lines.extend(['</g>', '</svg>'])
+        return '\n'.join(lines) + '\n'
+
+    def get_tree(self, name):
+        schema = self.struct.get_schema_by_name(name)
+        if schema is None:
+            raise KeyError('SchemaNotFound: ' + name)
+        family = self.struct.get_family_by_schema(schema)
+        return TreeLayout(family, self.text_metrics, self.font_size, level_spacing=self.level_spacing)
+
+    def _export(self, name, path):
+        try:
+            return name, self.export(name, path), None
+        except (KeyError, CycleError, OSError) as error:
+            return name, None, error.args[0] if isinstance(error, KeyError) else str(error)
+
+    @staticmethod
+    def _export_in_worker(name, path):
+        return Exporter.current._export(name, path)
+
+    def _get_edge_points(self, tree):
+        points = list()
+        for parent, child in tree.get_edges():
+            parent_x, parent_y, parent_width, _ = tree.rects[parent]
+            child_x, child_y, child_width, child_height = tree.rects[child]
+            start = (child_x + child_width / 2, tree.height - child_y - child_height)
+            end = (parent_x + parent_width / 2, tree.height - parent_y)
+            points.append((start, end))
+        return points
+
+    @staticmethod
+    def _init_worker(sources, use_cache, font_size, level_spacing, font):
+        if Exporter.current is None:
+            struct = Corpus(sources, use_cache=use_cache).get_struct()
+            Exporter.current = Exporter(struct, sources, use_cache, font_size, level_spacing, font)
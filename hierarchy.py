@@ -1,39 +1,70 @@
-from PIL import ImageFont
+import array, threading, time
+
 from kivy.clock import Clock
 from kivy.core.window import Window
 from kivy.factory import Factory
-from kivy.graphics import Line, Color
+from kivy.graphics import Color, InstructionGroup, Mesh
+from kivy.logger import Logger
 from kivy.uix.button import Button
-from kivy.uix.gridlayout import GridLayout
 from kivy.uix.screenmanager import Screen
 
+from corpus import Corpus
+from instrument import interaction, measure
+from layout import SpatialGrid, TextMetrics, TreeLayout
 from schema import *
+from validate import Validator
+from watch import Watcher
 
 
 FILE_PATH = ''
 FONT_SIZE = 20
-
-
-def schedule(func):
-    def decorate(*args):
-        Clock.schedule_once(callback=lambda *_: func(*args))
-    return decorate
+LEVEL_SPACING = 100
+MESH_EDGES = 32767
+SEARCH_PAGE_SIZE = 50
+VIEWPORT_MARGIN = 200
+WATCH_INTERVAL = 1
 
 
 class Hierarchy(Screen):
     def __init__(self, args, **kwargs):
         super().__init__(**kwargs)
         self._parse_args(args)
-        lines = File(FILE_PATH).get_lines()
-        self.struct = Struct(lines)
-
+        self.struct = None
+        self.corpus = Corpus(FILE_PATH, use_cache=not args.no_cache)
+        self.watcher = None
+        self.is_watching = args.watch
+        self.text_metrics = TextMetrics('Montserrat-Medium.ttf', FONT_SIZE)
+
+        self.tree = None
+        self.center_name = str()
         self.name_button_map = dict()
-        self.line_colors = list()
+        self.edges = list()
+        self.edge_points = array.array('f')
+        self.edge_highlights = bytearray()
+        self.edge_grid = SpatialGrid()
+        self.visible_edges = list()
+        self.edge_group = InstructionGroup()
+        self.edge_color = Color(rgba=[0, 0, 0, 1])
+        self.highlight_group = InstructionGroup()
         self.colored_node_name = str()
+        self.node_edges = dict()
+        self.highlighted_edges = dict()
+        self.mouse_pos = (0, 0)
+        self.color_lines_trigger = Clock.create_trigger(self._color_lines)
+        self.viewport_trigger = Clock.create_trigger(self._update_viewport)
+        self.search_query = str()
         self.is_visible = True
 
+        self.progress_event = Clock.schedule_interval(self._update_progress, 0.1)
+        threading.Thread(target=self._load_struct, daemon=True).start()
+
+    def on_mouse_pos(self, window, pos):
+        self.mouse_pos = pos
+        self.color_lines_trigger()
+
     def on_release_back_button(self, back_button):
-        [event.cancel() for event in Clock.get_events()]
+        self.color_lines_trigger.cancel()
+        self.viewport_trigger.cancel()
         self._show_search()
 
     def on_release_show_button(self, show_button):
@@ -46,34 +77,32 @@ class Hierarchy(Screen):
             self.is_visible = False
             self._reset_line_colors()
 
+    @interaction('tree open')
     def on_release_search_item_button(self, item_button):
         schema_name = item_button.text
         schema = self.struct.get_schema_by_name(schema_name)
-        family = self.struct.get_family_by_schema(schema)
-
-        self._show_tree()
-        self._add_gridlayouts_to_tree(count=family.get_max_depth() + 1)
-        self._add_buttons_to_tree(schema, family)
-        self._center_layouts()
-        self._add_lines_to_tree(schema)
+        if self._set_tree(schema):
+            self._show_tree()
+            Window.bind(mouse_pos=self.on_mouse_pos)
 
+    @interaction('node popup')
     def on_release_tree_node(self, name):
         schema = self.struct.get_schema_by_name(name)
-        description = str()
+        sections = list()
 
         # Type
         if schema.types:
-            description += 'Types\n'
-            for type in schema.types:
-                description += '        ' + type + '\n'
-            description += '\n\n'
+            sections.append(('Types', schema.types))
 
         # Description
-        for key, value in schema.descriptions.items():
-            description += key.capitalize() + '\n'
-            for item in value:
-                description += '        ' + item + '\n'
-            description += '\n\n'
+        sections.extend((key.capitalize(), value) for key, value in schema.descriptions.items())
+
+        parts = list()
+        for title, items in sections:
+            parts.append(title + '\n')
+            parts.extend('        ' + item + '\n' for item in items)
+            parts.append('\n\n')
+        description = ''.join(parts)
 
         # Open popup
         popup = Factory.CustomPopup()
@@ -81,184 +110,279 @@ class Hierarchy(Screen):
         popup.description = description
         popup.open()
 
+    @interaction('tree expand')
+    def on_release_tree_aggregate(self, key):
+        self.tree.expand(key)
+        self._draw_tree()
+
+    @interaction('search scroll')
+    def on_scroll_search_result(self, search_result):
+        scrollable = max(search_result.layout_manager.height - search_result.height, 0)
+        if search_result.scroll_y * scrollable < search_result.height and self.search_query:
+            self._add_search_result_page()
+
+    def on_scroll_tree(self, tree_view):
+        if self.tree is not None:
+            self.viewport_trigger()
+
+    @interaction('search keystroke')
     def on_text_search_input(self, text_input):
         if self._search_input_is_valid(text_input):
-            search_result = self._get_schemas_by_keyword(text_input.text.lower())
-            search_result.sort()
-            self._set_search_result(search_result)
-
-    def _add_gridlayouts_to_tree(self, count):
-        for _ in range(count):
-            gridlayout = GridLayout(rows=1, size_hint=(None, None), height=40, pos_hint={'x': 0, 'y': 0})
-            gridlayout.width = gridlayout.minimum_width
-            gridlayout.spacing = 10
-            self.ids.tree_layout.add_widget(gridlayout)
-
-    def _add_button_to_tree(self, level, name, center):
-        layout = self.ids.tree_layout.children[level]
-        short_name = name[name.find(' ') + 1: -1]
+            self.search_query = text_input.text
+            self.ids.search_result.data = list()
+            self.ids.search_result.scroll_y = 1
+            self._add_search_result_page()
+
+    @measure('render.button')
+    def _add_button_to_tree(self, key):
+        x, y, width, height = self.tree.rects[key]
+        if key in self.tree.aggregates:
+            on_release = lambda *_: self.on_release_tree_aggregate(key=key)
+        else:
+            on_release = lambda *_: self.on_release_tree_node(name=key)
         button = Button(
-            text=short_name,
+            text=self.tree.labels[key],
             font_name='Montserrat-Medium.ttf',
             font_size=FONT_SIZE,
             color=(0,0,0,1),
             background_normal='',
-            background_color=(1,1,0,1) if center else (0,0,0,0),
-            size_hint=(None, 1),
-            width=ImageFont.truetype(font='Montserrat-Medium.ttf', size=FONT_SIZE).getlength(text=short_name) + FONT_SIZE,
-            pos_hint={'x': 0, 'y': 0},
-            on_release=lambda *_: self.on_release_tree_node(name=name)
+            background_color=(1,1,0,1) if key == self.center_name else (0,0,0,0),
+            size_hint=(None, None),
+            size=(width, height),
+            pos=(x, y),
+            on_release=on_release
         )
-        layout.add_widget(button)
-        layout.width = sum([widget.width for widget in layout.children]) + (layout.spacing[0] * (len(layout.children) - 1))
-        self.name_button_map[name] = button
-
-    def _add_buttons_to_tree(self, schema, family):
-        self.name_button_map = dict()
-        for member in family.members:
-            self._add_button_to_tree(
-                level=family.get_max_depth() - member.depth,
-                name=member.name,
-                center=member.name == schema.name
-            )
-
-    @schedule
-    @schedule
-    def _add_lines_to_tree(self, schema):
-        self.line_colors = list()
-        self._add_line_to_parents(schema)
-        self._add_line_to_children(schema)
-        Window.bind(mouse_pos=self._color_lines)
-
-    def _add_line_to_parents(self, schema):
-        if schema.parents:
-            my_point = self._get_center_point_by_name(schema.name)
-            for parent in schema.parents:
-                parent_point = self._get_center_point_by_name(parent.name)
-                with self.name_button_map[schema.name].canvas:
-                    color = Color(rgba=[0,0,0,1])
-                    Line(points=[my_point[0], my_point[1] + FONT_SIZE, parent_point[0], parent_point[1] - FONT_SIZE], width=1)
-                    self.line_colors.append(LineColor(schema.name, parent.name, color))
-                self._add_line_to_parents(schema=parent)
-
-    def _add_line_to_children(self, schema):
-        if schema.children:
-            my_point = self._get_center_point_by_name(schema.name)
-            for child in schema.children:
-                child_point = self._get_center_point_by_name(child.name)
-                with self.name_button_map[schema.name].canvas:
-                    color = Color(rgba=[0,0,0,1])
-                    Line(points=[my_point[0], my_point[1] - FONT_SIZE, child_point[0], child_point[1] + FONT_SIZE], width=1)
-                    self.line_colors.append(LineColor(schema.name, child.name, color))
-                self._add_line_to_children(schema=child)
-
-    def _button_collides(self, button, pos):
-        x1, y1 = button.to_window(*button.pos)
-        x2, y2 = x1 + button.width, y1 + button.height
-        if pos[0] >= x1 and pos[0] <= x2 and pos[1] >= y1 and pos[1] <= y2:
-            return True
-        return False
-
-    @schedule
-    def _center_layouts(self):
-        max_width = self.ids.tree_layout.width
-        for layout in self.ids.tree_layout.children:
-            left_padding = (max_width - layout.width) / 2
-            layout.padding = (left_padding, 0, 0, 0)
-
-    def _color_lines(self, window, pos):
-        for name, button in self.name_button_map.items():
-            if self._button_collides(button, pos):
-                if name != self.colored_node_name:
-                    self._reset_line_colors()
-                    schema = self.struct.get_schema_by_name(name=name)
-                    family_names = set(schema.get_family_names())
-                    for line_color in self.line_colors:
-                        if line_color.node_name_1 in family_names and line_color.node_name_2 in family_names:
-                            line_color.color.rgba = [1, 0, 0, 1]
-                    self.colored_node_name = name
-                return
+        self.ids.tree_layout.add_widget(button)
+        self.name_button_map[key] = button
+
+    @measure('search.page')
+    def _add_search_result_page(self):
+        search_result = self.ids.search_result
+        layout = search_result.layout_manager
+        names = self.struct.get_search_index().search(self.search_query, limit=SEARCH_PAGE_SIZE, offset=len(search_result.data))
+        if not names:
+            return
+        top = (1 - search_result.scroll_y) * max(layout.height - search_result.height, 0)
+        search_result.data.extend({'text': name, 'font_size': FONT_SIZE} for name in names)
+        scrollable = len(search_result.data) * layout.default_size[1] - search_result.height
+        if scrollable > 0:
+            search_result.scroll_y = 1 - top / scrollable
+
+    def _clear_search_result(self):
+        self.search_query = str()
+        self.ids.search_result.data = list()
+
+    @interaction('hover')
+    def _color_lines(self, *_):
+        if self.tree is None:
+            return
+        name = self.tree.grid.get_key_at(*self.ids.tree_layout.to_widget(*self.mouse_pos, relative=True))
+        if name is not None and name not in self.tree.aggregates:
+            if name != self.colored_node_name:
+                self._reset_line_colors()
+                self._highlight_edges(self._get_highlighted_edges(name))
+                self.colored_node_name = name
+            return
         if self.colored_node_name != str():
             self.colored_node_name = str()
             self._reset_line_colors()
 
-    def _get_center_point_by_name(self, name):
-        button = self.name_button_map[name]
-        x = button.x + button.width / 2
-        y = button.y + button.height / 2
-        return x, y
+    @measure('render.highlights')
+    def _draw_highlights(self):
+        self.highlight_group.clear()
+        self.highlight_group.add(Color(rgba=[1, 0, 0, 1]))
+        for mesh in self._get_edge_meshes([index for index in self.visible_edges if self.edge_highlights[index]]):
+            self.highlight_group.add(mesh)
 
-    def _get_schemas_by_keyword(self, keyword):
-        search_result = list()
-        for schema in self.struct.schemas:
-            if keyword in schema.name:
-                search_result.append(schema.name)
-        return search_result
+    @measure('render.tree')
+    def _draw_tree(self):
+        self.ids.tree_layout.clear_widgets()
+        self.ids.tree_layout.size = (self.tree.width, self.tree.height)
+        self.name_button_map = dict()
+        self.edges = self.tree.get_edges()
+        self.edge_points = array.array('f')
+        for parent, child in self.edges:
+            parent_x, parent_y, parent_width, _ = self.tree.rects[parent]
+            child_x, child_y, child_width, child_height = self.tree.rects[child]
+            self.edge_points.extend([child_x + child_width / 2, child_y + child_height, parent_x + parent_width / 2, parent_y])
+        self.edge_highlights = bytearray(len(self.edges))
+        self.edge_color = Color(rgba=[0, 0, 0, 1] if self.is_visible else [0, 0, 0, 0])
+        self.colored_node_name = str()
+        self._index_tree()
+        self._update_viewport()
+
+    @measure('watch.reload')
+    def _apply_changes(self, changes, applied):
+        try:
+            self.watcher.apply(changes)
+        finally:
+            applied.set()
+        if self.search_query:
+            self.ids.search_result.data = list()
+            self.ids.search_result.scroll_y = 1
+            self._add_search_result_page()
+        if self.tree is not None:
+            schema = self.struct.get_schema_by_name(self.center_name)
+            if schema is None or not self._set_tree(schema):
+                self._show_search()
+
+    @measure('render.meshes')
+    def _get_edge_meshes(self, indices):
+        meshes = list()
+        for start in range(0, len(indices), MESH_EDGES):
+            vertices = list()
+            for index in indices[start:start + MESH_EDGES]:
+                x1, y1, x2, y2 = self.edge_points[index * 4:index * 4 + 4]
+                vertices.extend([x1, y1, 0, 0, x2, y2, 0, 0])
+            meshes.append(Mesh(vertices=vertices, indices=list(range(len(vertices) // 4)), mode='lines'))
+        return meshes
+
+    @measure('render.highlight_edges')
+    def _get_highlighted_edges(self, name):
+        if name not in self.highlighted_edges:
+            family_names = self.struct.get_schema_by_name(name).get_family_names()
+            family_keys = {self.tree.node_keys[name] for name in family_names if name in self.tree.node_keys}
+            self.highlighted_edges[name] = sorted({
+                index
+                for key in family_keys
+                for index in self.node_edges.get(key, ())
+                if self.edges[index][0] in family_keys and self.edges[index][1] in family_keys
+            })
+        return self.highlighted_edges[name]
+
+    def _highlight_edges(self, indices):
+        for index in indices:
+            self.edge_highlights[index] = 1
+        self._draw_highlights()
+
+    @measure('render.index')
+    def _index_tree(self):
+        self.edge_grid = SpatialGrid(cell_size=1024)
+        self.node_edges = dict()
+        for index, (parent, child) in enumerate(self.edges):
+            x1, y1, x2, y2 = self.edge_points[index * 4:index * 4 + 4]
+            self.edge_grid.add(index, min(x1, x2), y1, abs(x2 - x1), y2 - y1)
+            self.node_edges.setdefault(parent, list()).append(index)
+            self.node_edges.setdefault(child, list()).append(index)
+        self.highlighted_edges = dict()
+
+    @measure('load')
+    def _load_struct(self):
+        try:
+            struct = self.corpus.get_struct()
+            struct.get_search_index()
+            if self.is_watching:
+                self.watcher = Watcher(self.corpus.paths, struct)
+        except Exception as error:
+            message = str(error)
+            Clock.schedule_once(lambda *_, message=message: self._set_load_failed(message))
+            return
+        Clock.schedule_once(lambda *_: self._set_struct(struct))
+        self._validate(struct)
+        if self.watcher is not None:
+            self._watch_files()
 
     def _parse_args(self, args):
-        global FILE_PATH, FONT_SIZE
+        global FILE_PATH, FONT_SIZE, LEVEL_SPACING
         FILE_PATH = args.p
         FONT_SIZE = args.f if args.f else 20
-        self.ids.tree_layout.spacing = args.s if args.s else 100
+        LEVEL_SPACING = args.s if args.s else 100
 
     def _reset_line_colors(self):
-        for line_color in self.line_colors:
-            line_color.color.rgba = [0, 0, 0, 1] if self.is_visible else [0, 0, 0, 0]
+        self.edge_color.rgba = [0, 0, 0, 1] if self.is_visible else [0, 0, 0, 0]
+        self.edge_highlights = bytearray(len(self.edges))
+        self.highlight_group.clear()
 
     def _search_input_is_valid(self, text_input):
         text = text_input.text.lower()
         if not text:
-            self.ids.search_result.clear_widgets()
+            self._clear_search_result()
             return False
         if text == ' ' or text[-1] == '\t':
             text_input.text = text[:-1]
             return False
         return True
 
-    def _set_search_result(self, search_result: list):
-        self.ids.search_result.clear_widgets()
-        for item in search_result:
-            button = Button(
-                text=item,
-                color=(0, 0, 0, 1),
-                font_size=FONT_SIZE,
-                background_normal='',
-                background_color=(0, 0, 0, 0),
-                size_hint=(1, None),
-                height=100,
-                pos_hint={'x': 0, 'y': 0},
-                on_release=lambda *bound_args: self.on_release_search_item_button(bound_args[0])
-            )
-            self.ids.search_result.add_widget(button)
+    def _set_load_failed(self, message):
+        self.progress_event.cancel()
+        Logger.error('LoadFailed: ' + message)
+        self.ids.search_input.hint_text = 'Failed To Load ' + ' '.join(FILE_PATH)
+
+    def _set_struct(self, struct):
+        self.progress_event.cancel()
+        self.struct = struct
+        self.ids.load_progress.opacity = 0
+        self.ids.search_input.disabled = False
+        self.ids.search_input.hint_text = 'Type Schema Name To Search'
+        self.ids.search_input.focus = True
+
+    def _set_tree(self, schema):
+        try:
+            family = self.struct.get_family_by_schema(schema)
+        except CycleError as error:
+            Logger.error(str(error))
+            return False
+        self.tree = TreeLayout(family, self.text_metrics, FONT_SIZE, level_spacing=LEVEL_SPACING)
+        self.center_name = schema.name
+        self._draw_tree()
+        return True
 
     def _show_search(self):
         self.ids.tree.pos_hint = {'x': 1, 'y': 0}
         self.ids.search.pos_hint = {'x': 0, 'y': 0}
+        self.tree = None
         self.ids.tree_layout.clear_widgets()
+        self.edge_group.clear()
 
     def _show_tree(self):
         self.ids.search.pos_hint = {'x': 1, 'y': 0}
         self.ids.tree.pos_hint = {'x': 0.01, 'top': 0.99}
         self.ids.search_input.text = ''
-        self.ids.search_result.clear_widgets()
-
-    def _sort_family_by_height(self, family):
-        sorted_family = list()
-        for member in family:
-            if not sorted_family:
-                sorted_family.append(member)
-            else:
-                for i in range(len(sorted_family)):
-                    if member.height >= sorted_family[i].height:
-                        sorted_family.insert(i, member)
-                        break
-                if member not in sorted_family:
-                    sorted_family.append(member)
-        return sorted_family
-
-
-class LineColor:
-    def __init__(self, name1, name2, color):
-        self.node_name_1 = name1
-        self.node_name_2 = name2
-        self.color = color
\ No newline at end of file
+        self._clear_search_result()
+
+    @measure('render.viewport')
+    def _update_viewport(self, *_):
+        tree_view = self.ids.tree_view
+        tree_layout = self.ids.tree_layout
+        x = max(tree_layout.width - tree_view.width, 0) * tree_view.scroll_x
+        y = max(tree_layout.height - tree_view.height, 0) * tree_view.scroll_y
+        viewport = (x - VIEWPORT_MARGIN, y - VIEWPORT_MARGIN, x + tree_view.width + VIEWPORT_MARGIN, y + tree_view.height + VIEWPORT_MARGIN)
+
+        keys = self.tree.grid.get_keys_in(*viewport)
+        for key in [key for key in self.name_button_map if key not in keys]:
+            tree_layout.remove_widget(self.name_button_map.pop(key))
+        for key in keys:
+            if key not in self.name_button_map:
+                self._add_button_to_tree(key)
+
+        self.visible_edges = sorted(self.edge_grid.get_keys_in(*viewport))
+        if self.edge_group not in tree_layout.canvas.children:
+            tree_layout.canvas.insert(0, self.edge_group)
+        self.edge_group.clear()
+        self.edge_group.add(self.edge_color)
+        for mesh in self._get_edge_meshes(self.visible_edges):
+            self.edge_group.add(mesh)
+        self.edge_group.add(self.highlight_group)
+        self._draw_highlights()
+
+    def _update_progress(self, *_):
+        self.ids.load_progress.value = self.corpus.get_progress()
+
+    def _validate(self, struct):
+        validator = Validator(struct)
+        try:
+            validator.run()
+        except Exception as error:
+            Logger.error('ValidationFailed: ' + str(error))
+            return
+        if validator.diagnostics:
+            Logger.warning('Validation: ' + validator.get_summary() + '. Run the validate command for details')
+
+    def _watch_files(self):
+        while True:
+            time.sleep(WATCH_INTERVAL)
+            changes = self.watcher.poll()
+            if changes:
+                applied = threading.Event()
+                Clock.schedule_once(lambda *_: self._apply_changes(changes, applied))
+                applied.wait()
@@ -0,0 +1,186 @@
+import atexit, functools, inspect, json, os, sys, threading, time, tracemalloc
+
+
+PROFILE_VARIABLE = 'SCHEMA_PROFILE'
+MEMORY_VARIABLE = 'SCHEMA_PROFILE_MEMORY'
+STAGE = 'stage'
+INTERACTION = 'interaction'
+TOP_STAGES = 5
+
+
+class Profiler:
+    current = None
+
+    def __init__(self, path, is_traced=False):
+        self.path = path
+        self.is_traced = is_traced
+        self.pid = os.getpid()
+        self.origin = time.perf_counter_ns()
+        self.events = list()
+        self.thread_names = dict()
+        self.local = threading.local()
+        self.interaction_count = 0
+
+    @classmethod
+    def start(cls, path, is_traced=False):
+        if cls.current is None:
+            cls.current = Profiler(path, is_traced)
+            atexit.register(cls.current.write)
+        cls.current.path = path
+        if is_traced and not cls.current.is_traced:
+            cls.current.is_traced = True
+        if cls.current.is_traced and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        return cls.current
+
+    def get_summary(self):
+        stages = dict()
+        interactions = dict()
+        interaction_names = dict()
+        for name, category, _, _, duration, active, allocated, interaction_id in self.events:
+            if category == INTERACTION:
+                interaction_names[interaction_id] = name
+                row = interactions.setdefault(name, {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'stages': dict()})
+                row['count'] += 1
+                row['seconds'] += duration / 1e9
+                row['max_seconds'] = max(row['max_seconds'], duration / 1e9)
+                continue
+            row = stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'max_seconds': 0.0, 'allocated_bytes': 0})
+            row['calls'] += 1
+            row['seconds'] += active / 1e9
+            row['max_seconds'] = max(row['max_seconds'], active / 1e9)
+            row['allocated_bytes'] += allocated
+        for name, category, _, _, duration, active, allocated, interaction_id in self.events:
+            if category == STAGE and interaction_id in interaction_names:
+                totals = interactions[interaction_names[interaction_id]]['stages']
+                totals[name] = totals.get(name, 0.0) + active / 1e9
+        for row in [*stages.values(), *interactions.values()]:
+            row['mean_seconds'] = row['seconds'] / (row['calls'] if 'calls' in row else row['count'])
+            if not self.is_traced:
+                row.pop('allocated_bytes', None)
+        return {'stages': stages, 'interactions': interactions}
+
+    def get_trace(self):
+        events = [
+            {'name': 'thread_name', 'ph': 'M', 'pid': self.pid, 'tid': tid, 'args': {'name': name}}
+            for tid, name in self.thread_names.items()
+        ]
+        for name, category, tid, start, duration, active, allocated, interaction_id in self.events:
+            args = {'active_ms': active / 1e6} if active != duration else dict()
+            if self.is_traced and category == STAGE:
+                args['allocated_bytes'] = allocated
+            if interaction_id:
+                args['interaction'] = interaction_id
+            events.append({
+                'name': name, 'cat': category, 'ph': 'X', 'pid': self.pid, 'tid': tid,
+                'ts': (start - self.origin) / 1e3, 'dur': duration / 1e3, 'args': args,
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms', 'summary': self.get_summary()}
+
+    def measure(self, function, name, category):
+        if inspect.isgeneratorfunction(function):
+            return self._measure_generator(function, name)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            stack = self._get_stack()
+            if category == INTERACTION:
+                self.interaction_count += 1
+                stack.append(self.interaction_count)
+            memory = self._get_memory()
+            start = time.perf_counter_ns()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                duration = time.perf_counter_ns() - start
+                interaction_id = stack.pop() if category == INTERACTION else stack[-1] if stack else 0
+                self._record(name, category, start, duration, duration, self._get_memory() - memory, interaction_id)
+        return wrapper
+
+    def write(self, path=None):
+        path = path or self.path
+        if os.getpid() != self.pid or not self.events:
+            return
+        try:
+            with open(path, 'w') as outfile:
+                json.dump(self.get_trace(), outfile)
+        except OSError as error:
+            sys.stderr.write('ProfileNotWritten: ' + str(error) + '\n')
+            return
+        sys.stderr.write(self._get_report() + 'Profile: ' + path + '\n')
+
+    def _get_memory(self):
+        return tracemalloc.get_traced_memory()[0] if self.is_traced else 0
+
+    def _get_report(self):
+        summary = self.get_summary()
+        lines = ['%-28s %8s %10s %10s %10s%s' % ('stage', 'calls', 'total ms', 'mean ms', 'max ms', ' %12s' % 'bytes' if self.is_traced else '')]
+        for name, row in sorted(summary['stages'].items(), key=lambda item: -item[1]['seconds']):
+            lines.append('%-28s %8d %10.2f %10.3f %10.3f%s' % (
+                name, row['calls'], row['seconds'] * 1e3, row['mean_seconds'] * 1e3, row['max_seconds'] * 1e3,
+                ' %12d' % row['allocated_bytes'] if self.is_traced else ''))
+        if summary['interactions']:
+            lines.append('')
+            lines.append('%-28s %8s %10s %10s %10s  %s' % ('interaction', 'count', 'total ms', 'mean ms', 'max ms', 'slowest stages'))
+        for name, row in sorted(summary['interactions'].items(), key=lambda item: -item[1]['seconds']):
+            slowest = sorted(row['stages'].items(), key=lambda item: -item[1])[:TOP_STAGES]
+            lines.append('%-28s %8d %10.2f %10.3f %10.3f  %s' % (
+                name, row['count'], row['seconds'] * 1e3, row['mean_seconds'] * 1e3, row['max_seconds'] * 1e3,
+                ', '.join('%s %.2f' % (stage, seconds * 1e3) for stage, seconds in slowest)))
+        return '\n'.join(lines) + '\n'
+
+    def _get_stack(self):
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = list()
+            thread = threading.current_thread()
+            self.thread_names[threading.get_ident()] = thread.name
+        return stack
+
+    def _measure_generator(self, function, name):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            stack = self._get_stack()
+            interaction_id = stack[-1] if stack else 0
+            start = time.perf_counter_ns()
+            active = 0
+            allocated = 0
+            generator = function(*args, **kwargs)
+            try:
+                while True:
+                    memory = self._get_memory()
+                    resumed = time.perf_counter_ns()
+                    try:
+                        value = next(generator)
+                    except StopIteration as stop:
+                        return stop.value
+                    finally:
+                        active += time.perf_counter_ns() - resumed
+                        allocated += self._get_memory() - memory
+                    yield value
+            finally:
+                self._record(name, STAGE, start, time.perf_counter_ns() - start, active, allocated, interaction_id)
+        return wrapper
+
+    def _record(self, name, category, start, duration, active, allocated, interaction_id):
+        self.events.append((name, category, threading.get_ident(), start, duration, active, allocated, interaction_id))
+
+
+def interaction(name):
+    return _decorate(name, INTERACTION)
+
+
+def measure(name):
+    return _decorate(name, STAGE)
+
+
+def _decorate(name, category):
+    def decorator(function):
+        if Profiler.current is None:
+            return function
+        return Profiler.current.measure(function, name, category)
+    return decorator
+
+
+if os.environ.get(PROFILE_VARIABLE):
+    Profiler.start(os.environ[PROFILE_VARIABLE], bool(os.environ.get(MEMORY_VARIABLE)))
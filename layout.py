@@ -0,0 +1,137 @@
+from PIL import ImageFont
+
+from instrument import measure
+from schema import LRUCache
+
+
+class TextMetrics:
+    fonts = dict()
+
+    def __init__(self, font, size, maxsize=65536):
+        self.font = self.get_font(font, size)
+        self.widths = LRUCache(maxsize)
+
+    @classmethod
+    def get_font(cls, font, size):
+        key = (font, size)
+        if key not in cls.fonts:
+            cls.fonts[key] = ImageFont.truetype(font=font, size=size)
+        return cls.fonts[key]
+
+    def get_width(self, text):
+        width = self.widths.get(text)
+        if width is None:
+            width = self.widths.put(text, self.font.getlength(text=text))
+        return width
+
+    @measure('layout.measure')
+    def get_widths(self, texts):
+        widths = {text: self.get_width(text) for text in dict.fromkeys(texts)}
+        return [widths[text] for text in texts]
+
+
+class SpatialGrid:
+    def __init__(self, cell_size=256):
+        self.cell_size = cell_size
+        self.cells = dict()
+
+    def add(self, key, x, y, width, height):
+        rect = (x, y, x + width, y + height, key)
+        for cell in self._get_cells(*rect[:4]):
+            self.cells.setdefault(cell, list()).append(rect)
+
+    def get_key_at(self, x, y):
+        for x1, y1, x2, y2, key in self.cells.get((int(x // self.cell_size), int(y // self.cell_size)), ()):
+            if x1 <= x <= x2 and y1 <= y <= y2:
+                return key
+
+    def get_keys_in(self, x1, y1, x2, y2):
+        keys = set()
+        for cell in self._get_cells(x1, y1, x2, y2):
+            for left, bottom, right, top, key in self.cells.get(cell, ()):
+                if left <= x2 and x1 <= right and bottom <= y2 and y1 <= top:
+                    keys.add(key)
+        return keys
+
+    def _get_cells(self, x1, y1, x2, y2):
+        size = self.cell_size
+        return [
+            (column, row)
+            for column in range(int(x1 // size), int(x2 // size) + 1)
+            for row in range(int(y1 // size), int(y2 // size) + 1)
+        ]
+
+
+class TreeLayout:
+    def __init__(self, family, text_metrics, font_size, level_spacing=100, node_spacing=10, node_height=40, padding=10, max_level_nodes=200):
+        self.family = family
+        self.text_metrics = text_metrics
+        self.font_size = font_size
+        self.level_spacing = level_spacing
+        self.node_spacing = node_spacing
+        self.node_height = node_height
+        self.padding = padding
+        self.max_level_nodes = max_level_nodes
+        self.level_limits = dict()
+        self.labels = dict()
+        self.rects = dict()
+        self.aggregates = dict()
+        self.node_keys = dict()
+        self.grid = SpatialGrid()
+        self.width = 0
+        self.height = 0
+        self.update()
+
+    @staticmethod
+    def get_label(name):
+        return name[name.find(' ') + 1: -1]
+
+    def expand(self, key):
+        depth = self.aggregates[key]
+        self.level_limits[depth] = self.level_limits.get(depth, self.max_level_nodes) + self.max_level_nodes
+        self.update()
+
+    def get_center(self, key):
+        x, y, width, height = self.rects[key]
+        return x + width / 2, y + height / 2
+
+    def get_edges(self):
+        return list(dict.fromkeys((self.node_keys[parent.name], self.node_keys[child.name]) for parent, child in self.family.get_edges()))
+
+    @measure('layout')
+    def update(self):
+        max_depth = self.family.get_max_depth()
+        levels = [list() for _ in range(max_depth + 1)]
+        for member in self.family.members:
+            levels[self.family.get_depth(member)].append(member.name)
+
+        self.labels = dict()
+        self.aggregates = dict()
+        self.node_keys = dict()
+        rows = list()
+        for depth, names in enumerate(levels):
+            limit = self.level_limits.get(depth, self.max_level_nodes)
+            keys = names[:limit]
+            self.node_keys.update((name, name) for name in keys)
+            self.labels.update((name, self.get_label(name)) for name in keys)
+            if len(names) > limit:
+                key = '+' + str(depth)
+                keys.append(key)
+                self.aggregates[key] = depth
+                self.node_keys.update((name, key) for name in names[limit:])
+                self.labels[key] = '+' + str(len(names) - limit) + ' more'
+            widths = [width + self.font_size for width in self.text_metrics.get_widths([self.labels[key] for key in keys])]
+            rows.append((keys, widths, sum(widths) + self.node_spacing * max(len(widths) - 1, 0)))
+
+        max_width = max(row_width for _, _, row_width in rows)
+        self.width = max_width + 2 * self.padding
+        self.height = len(rows) * self.node_height + (len(rows) - 1) * self.level_spacing + 2 * self.padding
+        self.rects = dict()
+        self.grid = SpatialGrid()
+        for depth, (keys, widths, row_width) in enumerate(rows):
+            x = self.padding + (max_width - row_width) / 2
+            y = self.padding + (max_depth - depth) * (self.node_height + self.level_spacing)
+            for key, width in zip(keys, widths):
+                self.rects[key] = (x, y, width, self.node_height)
+                self.grid.add(key, x, y, width, self.node_height)
+                x += width + self.node_spacing
@@ -1,12 +1,49 @@
 import argparse, sys
 parser = argparse.ArgumentParser(description='Schema hierarchy generator parser')
-parser.add_argument('-p', type=str, required=True, help='Schema file path')
+parser.add_argument('-p', type=str, required=True, action='append', help='Schema file, directory of .txt files or glob. Repeat to merge several sources')
 parser.add_argument('-f', type=int, required=False, help='Font size. 20 by default')
 parser.add_argument('-s', type=int, required=False, help='Spacing between levels. 100 by default')
+parser.add_argument('--no-cache', action='store_true', help='Always parse the schema file instead of loading the compiled cache')
+parser.add_argument('--watch', action='store_true', help='Reload changed schema blocks while the window is open')
+parser.add_argument('--profile', type=str, required=False, help='Record stage timings and interactions and write a Chrome trace to this file on exit')
+parser.add_argument('--profile-memory', action='store_true', help='Also record the bytes allocated by every stage. Slower')
+output_parser = argparse.ArgumentParser(add_help=False)
+output_parser.add_argument('--format', choices=['json', 'tsv'], default='json', help='Output format. json by default')
+subparsers = parser.add_subparsers(dest='command', metavar='command', help='Run a headless query instead of opening the window')
+for command in ['ancestors', 'descendants', 'family']:
+    subparser = subparsers.add_parser(command, parents=[output_parser], help='Print the ' + command + ' of a schema')
+    subparser.add_argument('name', type=str, help='Schema name, e.g. "(?x header_1.n)"')
+search_parser = subparsers.add_parser('search', parents=[output_parser], help='Print schema names containing a keyword')
+search_parser.add_argument('keyword', type=str, help='Case-insensitive keyword')
+search_parser.add_argument('--limit', type=int, required=False, help='Maximum number of results')
+search_parser.add_argument('--mode', choices=['substring', 'prefix', 'token'], default='substring', help='Match anywhere, at the start of the schema name, or by word prefixes')
+export_parser = subparsers.add_parser('export', parents=[output_parser], help='Render the hierarchy of schemas to SVG or PNG files without opening the window')
+export_parser.add_argument('names', type=str, nargs='*', help='Schema names to render')
+export_parser.add_argument('--all', action='store_true', help='Render every schema')
+export_parser.add_argument('--output-dir', type=str, default='.', help='Directory for the rendered files. The current directory by default')
+export_parser.add_argument('--image-format', choices=['svg', 'png'], default='svg', help='Image format. svg by default')
+export_parser.add_argument('--workers', type=int, required=False, help='Worker processes. One per CPU by default')
+serve_parser = subparsers.add_parser('serve', help='Keep the parsed schemas loaded and answer queries over HTTP/JSON')
+serve_parser.add_argument('--host', type=str, default='127.0.0.1', help='Address to bind. 127.0.0.1 by default')
+serve_parser.add_argument('--port', type=int, default=8000, help='Port to bind. 8000 by default')
+serve_parser.add_argument('--cache-size', type=int, default=1024, help='Cached family, ancestor and descendant responses. 1024 by default')
+diff_parser = subparsers.add_parser('diff', parents=[output_parser], help='Compare the -p sources with a newer version. Exits 1 when they differ')
+diff_parser.add_argument('new', type=str, nargs='+', help='Newer schema file, directory of .txt files or glob')
+subparsers.add_parser('validate', parents=[output_parser], help='Print parse errors, missing headers, cycles and orphans. Exits 1 on errors')
 args = parser.parse_args()
 sys.argv = [sys.argv[0]]
 
 
+if args.profile:
+    from instrument import Profiler
+    Profiler.start(args.profile, args.profile_memory)
+
+
+if args.command:
+    from query import Query
+    sys.exit(Query(args).run())
+
+
 from kivy.config import Config
 Config.set('kivy', 'keyboard_mode', 'systemanddock')
 Config.set('input', 'mouse', 'mouse,multitouch_on_demand')
@@ -0,0 +1,116 @@
+import json, logging, sys
+
+from corpus import Corpus
+from diff import Differ
+from schema import *
+from validate import Validator
+
+
+logger = logging.getLogger(__name__)
+
+
+class Query:
+    def __init__(self, args, output=sys.stdout):
+        self.args = args
+        self.output = output
+        self.struct = None
+
+    def run(self):
+        logging.basicConfig(format='%(levelname)s: %(message)s', stream=sys.stderr)
+        if self.args.command == 'diff':
+            return self._run_diff()
+        try:
+            self.struct = Corpus(self.args.p, use_cache=not self.args.no_cache).get_struct()
+        except OSError as error:
+            logger.error(str(error))
+            return 2
+        return getattr(self, '_run_' + self.args.command)()
+
+    def _get_schema(self):
+        schema = self.struct.get_schema_by_name(self.args.name)
+        if schema is None:
+            logger.error('SchemaNotFound: ' + self.args.name)
+        return schema
+
+    def _run_ancestors(self):
+        schema = self._get_schema()
+        if schema is None:
+            return 1
+        self._write(schema.get_ancestor_names())
+        return 0
+
+    def _run_descendants(self):
+        schema = self._get_schema()
+        if schema is None:
+            return 1
+        self._write(schema.get_descendant_names())
+        return 0
+
+    def _run_diff(self):
+        differ = Differ(self.args.p, self.args.new)
+        try:
+            differ.run()
+        except OSError as error:
+            logger.error(str(error))
+            return 2
+        self._write(differ.get_report() if self.args.format == 'json' else differ.get_rows())
+        return 1 if differ.has_changes() else 0
+
+    def _run_export(self):
+        from export import Exporter
+        names = [schema.name for schema in self.struct.schemas] if self.args.all else self.args.names
+        exporter = Exporter(self.struct, self.args.p, not self.args.no_cache, self.args.f or 20, self.args.s or 100)
+        results = exporter.export_all(names, self.args.output_dir, self.args.image_format, self.args.workers)
+        self._write([{'name': name, 'path': path, 'error': error} for name, path, error in results])
+        return 1 if any(error for _, _, error in results) else 0
+
+    def _run_family(self):
+        schema = self._get_schema()
+        if schema is None:
+            return 1
+        try:
+            family = self.struct.get_family_by_schema(schema)
+        except CycleError as error:
+            logger.error(str(error))
+            return 1
+        self._write([
+            {'name': member.name, 'depth': family.get_depth(member), 'height': family.get_height(member)}
+            for member in family.members
+        ])
+        return 0
+
+    def _run_search(self):
+        self._write(SearchIndex.scan(self.struct.name_schema_map, self.args.keyword, self.args.mode, self.args.limit or None))
+        return 0
+
+    def _run_serve(self):
+        from server import Server
+        logging.getLogger().setLevel(logging.INFO)
+        try:
+            Server(self.struct, self.args.host, self.args.port, self.args.cache_size).run()
+        except KeyboardInterrupt:
+            pass
+        except OSError as error:
+            logger.error(str(error))
+            return 2
+        return 0
+
+    def _run_validate(self):
+        validator = Validator(self.struct)
+        validator.run()
+        report = validator.get_report()
+        self._write(report if self.args.format == 'json' else report['diagnostics'])
+        return 1 if report['errors'] else 0
+
+    def _write(self, result):
+        if self.args.format == 'json':
+            json.dump(result, self.output, indent=2)
+            self.output.write('\n')
+            return
+        rows = result.items() if isinstance(result, dict) else result
+        for row in rows:
+            if isinstance(row, dict):
+                row = row.values()
+            elif not isinstance(row, (list, tuple)):
+                row = [row]
+            self.output.write('\t'.join(json.dumps(value) if isinstance(value, list) else str(value) for value in row) + '\n')
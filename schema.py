@@ -1,103 +1,425 @@
-import copy, sys
-from kivy.logger import Logger
+import array, bisect, collections, contextlib, heapq, io, itertools, logging, mmap, os, re, sys, threading
 
+from instrument import measure
 
-class DFS:
-    stack = 0
 
-    def __init__(self):
-        DFS.stack = 0
+logger = logging.getLogger(__name__)
 
-    def get_depth(self, node, depth):
-        if not node.parents:
-            if depth > DFS.stack:
-                DFS.stack = depth
-        else:
-            for parent in node.parents:
-                self.get_depth(parent, depth + 1)
-        return DFS.stack
-
-    def get_height(self, node, height):
-        if not node.children:
-            if height > DFS.stack:
-                DFS.stack = height
-        else:
-            for child in node.children:
-                self.get_height(child, height + 1)
-        return DFS.stack
+ERROR = 'error'
+WARNING = 'warning'
+UNLOADED = object()
+TOKEN_SEPARATOR = re.compile('[^0-9a-z]+')
+
+
+class CycleError(Exception):
+    def __init__(self, names):
+        super().__init__('Cycle: ' + ' -> '.join(names))
+        self.names = names
+
+
+class Diagnostic:
+    def __init__(self, code, severity, name='', detail='', sources=()):
+        self.code = code
+        self.severity = severity
+        self.name = name
+        self.detail = detail
+        self.sources = list(sources)
+        self.locations = list()
+
+    def __str__(self):
+        return ' '.join(filter(None, [self.code + ':', self.name, self.detail, *self.locations]))
+
+    def to_dict(self):
+        return {'code': self.code, 'severity': self.severity, 'name': self.name, 'detail': self.detail, 'locations': self.locations}
+
+
+class DescriptionStore:
+    def __init__(self, path, size=None, mtime_ns=None):
+        self.path = path
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.schema_offsets = array.array('Q', [0])
+        self.block_starts = array.array('Q')
+        self.block_ends = array.array('Q')
+        self.header_offsets = array.array('Q')
+        self.line_offsets = None
+        self.mmap = None
+        self.pieces = None
+        self.piece_offsets = None
+        self.piece_starts = None
+        self.virtual_end = size or 0
+
+    def add_block(self, start, end):
+        self.block_starts.append(start)
+        self.block_ends.append(end)
+
+    def add_schema(self, header_offset=0):
+        self.schema_offsets.append(len(self.block_starts))
+        self.header_offsets.append(header_offset)
+        return len(self.schema_offsets) - 2
+
+    def get_blocks(self, index):
+        blocks = range(self.schema_offsets[index], self.schema_offsets[index + 1])
+        return [(self.get_offset(self.block_starts[block]), self.get_offset(self.block_ends[block], True)) for block in blocks]
+
+    def get_descriptions(self, index):
+        buffer = self._get_mmap()
+        descriptions = dict()
+        if buffer is None:
+            return descriptions
+        for start, end in self.get_blocks(index):
+            lines = File(io.StringIO(buffer[start:end].decode())).get_lines()
+            key = next(lines)[1:]
+            descriptions[key] = [File.get_item(line) for line in lines]
+        return descriptions
+
+    def get_location(self, index):
+        return self.get_location_by_offset(self.get_offset(self.header_offsets[index]))
+
+    def get_locations(self, offsets):
+        offsets = [self.get_offset(offset) for offset in offsets]
+        buffer = self._get_mmap()
+        if buffer is None:
+            return [str(self.path) + '@' + str(offset) for offset in offsets]
+        lines = dict()
+        line = 1
+        position = 0
+        for offset in sorted(set(offsets)):
+            line += buffer[position:offset].count(b'\n')
+            position = offset
+            lines[offset] = line
+        return [str(self.path) + ':' + str(lines[offset]) for offset in offsets]
+
+    def get_location_by_offset(self, offset):
+        buffer = self._get_mmap()
+        if buffer is None:
+            return str(self.path) + '@' + str(offset)
+        if self.line_offsets is None:
+            self.line_offsets = array.array('Q', [match.end() for match in re.finditer(b'\n', buffer)])
+        return str(self.path) + ':' + str(bisect.bisect_right(self.line_offsets, offset) + 1)
+
+    def get_offset(self, offset, is_end=False):
+        if self.pieces is None:
+            return offset
+        search = bisect.bisect_left if is_end else bisect.bisect_right
+        virtual_start, file_start, _ = self.piece_starts[max(search(self.piece_offsets, offset) - 1, 0)]
+        return file_start + offset - virtual_start
+
+    def replace(self, start, end, new_end, virtual_start, size, mtime_ns):
+        delta = new_end - end
+        pieces = list()
+        for piece_start, file_start, length in self.pieces or [(0, 0, self.size)]:
+            if file_start < start:
+                pieces.append((piece_start, file_start, min(file_start + length, start) - file_start))
+            if file_start + length > end:
+                skip = max(end - file_start, 0)
+                pieces.append((piece_start + skip, file_start + skip + delta, length - skip))
+        pieces.append((virtual_start, start, new_end - start))
+        self.pieces = sorted(pieces, key=lambda piece: piece[1])
+        self.piece_starts = sorted(self.pieces)
+        self.piece_offsets = [piece[0] for piece in self.piece_starts]
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.line_offsets = None
+        self.mmap = None
+
+    def reserve(self, length):
+        for name in ('schema_offsets', 'block_starts', 'block_ends', 'header_offsets'):
+            if not isinstance(getattr(self, name), array.array):
+                setattr(self, name, array.array('Q', getattr(self, name)))
+        virtual_start = self.virtual_end + 1
+        self.virtual_end = virtual_start + length + 1
+        return virtual_start
+
+    def _get_mmap(self):
+        if self.mmap is None:
+            stat = os.stat(self.path)
+            if (stat.st_size, stat.st_mtime_ns) != (self.size, self.mtime_ns):
+                logger.warning('SourceChanged: ' + str(self.path))
+                return None
+            with open(self.path, 'rb') as infile:
+                self.mmap = mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+        return self.mmap
 
 
 class File:
-    def __init__(self, filePath):
-        self.filePath = filePath
+    def __init__(self, source, chunk_size=1 << 20, lazy=True, offset=0, description_store=None):
+        self.source = source
+        self.chunk_size = chunk_size
+        self.offset = offset
+        self.description_store = description_store
+        self.diagnostics = list()
+        if lazy and description_store is None and self._is_path():
+            stat = os.stat(source)
+            self.description_store = DescriptionStore(source, stat.st_size, stat.st_mtime_ns)
+
+    @staticmethod
+    def get_item(line):
+        if line[:1] in {'!', '?'}:
+            return line[line.find('('):]
+        return line
 
     def get_lines(self):
-        with open(self.filePath, 'r') as infile:
-            lines = infile.readlines()
-        lines = list(map(self._remove_comments, lines))
-        lines = list(map(str.strip, lines))
-        lines = list(map(lambda s: s.replace('  ', ''), lines))
-        lines = list(filter(None, lines))
-        lines = self._remove_linebreaks(lines)
-        return lines
+        for _, line in self._get_logical_lines():
+            yield line
+
+    @measure('parse')
+    def get_schemas(self):
+        schema = None
+        key = None
+        block_start = None
+        header_offset = 0
+        ids = set()
+        names = dict()
+        is_duplicate = False
+
+        for offset, line in self._get_logical_lines():
+            is_header = line[:len('obj-schema')] == 'obj-schema'
+            if block_start is not None and (is_header or line[:1] == ':'):
+                self.description_store.add_block(block_start, offset)
+                block_start = None
+
+            if is_header:
+                if schema is not None:
+                    yield self._close_schema(schema, header_offset)
+                schema = None
+                key = None
+                ids = set()
+                name = line[line.find('('):]
+                is_duplicate = name in names
+                if is_duplicate:
+                    self._add_diagnostic('DuplicateHeader', ERROR, name, '', names[name], offset)
+                    continue
+                schema = Schema(name=name)
+                if self.description_store is None:
+                    schema.descriptions = dict()
+                names[name] = offset
+                header_offset = offset
+
+            elif is_duplicate:
+                continue
+
+            elif schema is None:
+                self._add_diagnostic('NoHeader', WARNING, '', line, offset)
+
+            elif line[:1] == ':':
+                key = line[1:]
+                if key == 'types':
+                    schema.types = list()
+                elif self.description_store is not None:
+                    block_start = offset
+                else:
+                    schema.descriptions[key] = list()
+
+            elif key is None:
+                self._add_diagnostic('NoKey', WARNING, schema.name, line, offset)
+
+            else:
+                if line[:1] in {'!', '?'}:
+                    uid = line[1:line.find(' ')]
+                    if uid in ids:
+                        self._add_diagnostic('DuplicateID', WARNING, schema.name, uid, offset)
+                    else:
+                        ids.add(uid)
+                if key == 'types':
+                    schema.types.append(self.get_item(line))
+                elif self.description_store is None:
+                    schema.descriptions[key].append(self.get_item(line))
+
+        if block_start is not None:
+            self.description_store.add_block(block_start, self.offset)
+        if schema is not None:
+            yield self._close_schema(schema, header_offset)
+
+    def _add_diagnostic(self, code, severity, name, detail, *offsets):
+        self.diagnostics.append(Diagnostic(code, severity, name, detail, [(self.description_store, offset) for offset in offsets]))
+
+    def _close_schema(self, schema, header_offset):
+        if self.description_store is not None:
+            schema.description_store = self.description_store
+            schema.description_index = self.description_store.add_schema(header_offset)
+        return schema
+
+    def _get_lines(self):
+        with self._open() as infile:
+            rest = None
+            while True:
+                chunk = infile.read(self.chunk_size)
+                if not chunk:
+                    break
+                if rest:
+                    chunk = rest + chunk
+                is_binary = isinstance(chunk, bytes)
+                lines = chunk.split(b'\n' if is_binary else '\n')
+                rest = lines.pop()
+                for line in lines:
+                    yield self.offset, line.decode() if is_binary else line
+                    self.offset += len(line) + 1
+            if rest:
+                yield self.offset, rest.decode() if isinstance(rest, bytes) else rest
+                self.offset += len(rest)
+
+    def _get_logical_lines(self):
+        pending = None
+        pending_offset = 0
+        for offset, line in self._get_lines():
+            line = self._remove_comments(line).strip().replace('  ', '')
+            if not line:
+                continue
+            if line[:len('obj-schema')] == 'obj-schema' or line[:1] in {':', '!', '?'} or pending is None:
+                if pending is not None:
+                    yield pending_offset, pending
+                pending = line
+                pending_offset = offset
+            elif pending[:1] in {'!', '?'}:
+                pending += ' ' + line
+            else:
+                yield pending_offset, pending
+                pending = line
+                pending_offset = offset
+        if pending is not None:
+            yield pending_offset, pending
+
+    def _is_path(self):
+        return isinstance(self.source, (str, os.PathLike)) and self.source != '-'
+
+    def _open(self):
+        if self.source == '-':
+            return contextlib.nullcontext(sys.stdin.buffer)
+        if self._is_path():
+            return open(self.source, 'rb')
+        return contextlib.nullcontext(self.source)
 
     def _remove_comments(self, line):
         if ';' in line:
             line = line[:line.find(';')]
         return line
 
-    def _remove_linebreaks(self, lines):
-        newLines = list()
-        for line in lines:
-            if line[:len('obj-schema')] == 'obj-schema' or line[:1] in {':', '!', '?'}:
-                newLines.append(line)
-            else:
-                if newLines[-1][:1] in {'!', '?'}:
-                    newLines[-1] += ' ' + line
-                else:
-                    newLines.append(line)
-        return newLines
+
+class Graph:
+    def __init__(self, nodes):
+        self.nodes = nodes
+        self.parent_offsets = array.array('i', [0])
+        self.parent_indices = array.array('i')
+        self.child_offsets = array.array('i', [0])
+        self.child_indices = array.array('i')
+        self.parent_overrides = dict()
+        self.child_overrides = dict()
+        self.reachability = None
+
+    def get_child_ids(self, id):
+        return self._get_ids(id, self.child_offsets, self.child_indices, self.child_overrides)
+
+    def get_ids(self):
+        return self.nodes.get_ids()
+
+    def get_parent_ids(self, id):
+        return self._get_ids(id, self.parent_offsets, self.parent_indices, self.parent_overrides)
+
+    def get_reachability(self):
+        if self.reachability is None:
+            self.reachability = Reachability(self)
+        return self.reachability
+
+    def set_child_ids(self, id, ids):
+        self.child_overrides[id] = array.array('i', ids)
+        if self.reachability is not None:
+            self.reachability.clear()
+
+    def set_edges(self, parent_offsets, parent_indices, child_offsets=None, child_indices=None):
+        self.parent_offsets = parent_offsets
+        self.parent_indices = parent_indices
+        self.parent_overrides = dict()
+        self.child_overrides = dict()
+        self.reachability = None
+        if child_offsets is not None:
+            self.child_offsets = child_offsets
+            self.child_indices = child_indices
+            return
+
+        count = len(parent_offsets) - 1
+        child_counts = array.array('i', [0]) * (count + 1)
+        for parent in parent_indices:
+            child_counts[parent + 1] += 1
+        for id in range(count):
+            child_counts[id + 1] += child_counts[id]
+        self.child_offsets = array.array('i', child_counts)
+        self.child_indices = array.array('i', [0]) * len(parent_indices)
+        for id in range(count):
+            for parent in parent_indices[parent_offsets[id]:parent_offsets[id + 1]]:
+                self.child_indices[child_counts[parent]] = id
+                child_counts[parent] += 1
+
+    def set_parent_ids(self, id, ids):
+        self.parent_overrides[id] = array.array('i', ids)
+        if self.reachability is not None:
+            self.reachability.clear()
+
+    def _get_ids(self, id, offsets, indices, overrides):
+        if id in overrides:
+            return overrides[id]
+        if id + 1 < len(offsets):
+            return indices[offsets[id]:offsets[id + 1]]
+        return ()
 
 
 class Schema:
+    __slots__ = ('name', 'id', 'types', 'depth', 'height', 'graph', 'description_store', 'description_index', '_descriptions')
+
     def __init__(self, name):
         self.name = name
-        self.types = list()
-        self.descriptions = dict()
-        self.parents = list()
-        self.children = list()
+        self.id = None
+        self.types = ()
         self.depth = 0
         self.height = 0
+        self.graph = None
+        self.description_store = None
+        self.description_index = None
+        self._descriptions = None
+
+    @property
+    def children(self):
+        return [self.graph.nodes[id] for id in self.get_child_ids()]
 
-    def copy(self):
-        copy_schema = Schema(self.name)
-        copy_schema.types = copy.deepcopy(self.types)
-        copy_schema.descriptions = copy.deepcopy(self.descriptions)
-        return copy_schema
+    @property
+    def descriptions(self):
+        if self.description_store is not None:
+            return self.description_store.get_descriptions(self.description_index)
+        return self._descriptions if self._descriptions is not None else dict()
 
-    def find_depth(self):
-        self.depth = DFS().get_depth(node=self, depth=0)
+    @descriptions.setter
+    def descriptions(self, descriptions):
+        self.description_store = None
+        self.description_index = None
+        self._descriptions = descriptions
 
-    def find_height(self):
-        self.height = DFS().get_height(node=self, height=0)
+    @property
+    def parents(self):
+        return [self.graph.nodes[id] for id in self.get_parent_ids()]
+
+    def get_ancestor_ids(self):
+        return self.graph.get_reachability().get_ancestor_ids(self.id) if self.graph else ()
 
     def get_ancestor_names(self):
-        names = list()
-        self._find_ancestor_names(parents=self.parents, names=names)
-        return names
+        return [self.graph.nodes[id].name for id in self.get_ancestor_ids()]
+
+    def get_descendant_ids(self):
+        return self.graph.get_reachability().get_descendant_ids(self.id) if self.graph else ()
 
     def get_descendant_names(self):
-        names = list()
-        self._find_descendant_names(children=self.children, names=names)
-        return names
+        return [self.graph.nodes[id].name for id in self.get_descendant_ids()]
+
+    def get_family_ids(self):
+        return [self.id, *self.get_ancestor_ids(), *self.get_descendant_ids()]
 
     def get_family_names(self):
-        names = [self.name]
-        if self.parents:
-            names.extend(self.get_ancestor_names())
-        if self.children:
-            names.extend(self.get_descendant_names())
-        return names
+        return [self.graph.nodes[id].name for id in self.get_family_ids()] if self.graph else [self.name]
+
+    def get_child_ids(self):
+        return self.graph.get_child_ids(self.id) if self.graph else ()
+
+    def get_parent_ids(self):
+        return self.graph.get_parent_ids(self.id) if self.graph else ()
 
     def get_parent_names(self):
         return [parent.name for parent in self.parents]
@@ -111,248 +433,664 @@ class Schema:
                 names.append(type[idx - 1:])
         return names
 
-    def move_types(self):
-        if 'types' in self.descriptions:
-            types = self.descriptions['types']
-            self.types = types
-            del self.descriptions['types']
+    def is_ancestor_of(self, schema):
+        return self.graph is not None and self.graph.get_reachability().is_ancestor(self.id, schema.id)
+
+
+class SchemaMap:
+    def __init__(self, schemas):
+        self.schemas = schemas
+        self.ids = dict()
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def __delitem__(self, name):
+        del self.ids[name]
+
+    def __getitem__(self, name):
+        return self.schemas[self.ids[name]]
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __setitem__(self, name, schema):
+        self.ids[name] = schema.id
+
+    def add_ids(self, names, ids):
+        self.ids.update(zip(names, ids))
+
+    def get(self, name, default=None):
+        id = self.ids.get(name)
+        return default if id is None else self.schemas[id]
 
-    def _find_ancestor_names(self, parents: list, names: list):
-        for parent in parents:
-            names.append(parent.name)
-            self._find_ancestor_names(parents=parent.parents, names=names)
+    def get_id(self, name):
+        return self.ids.get(name)
 
-    def _find_descendant_names(self, children: list, names: list):
-        for child in children:
-            names.append(child.name)
-            self._find_descendant_names(children=child.children, names=names)
+    def values(self):
+        return [self.schemas[id] for id in self.ids.values()]
+
+
+class SchemaTable:
+    def __init__(self):
+        self.schemas = list()
+        self.load = None
+        self.lock = threading.Lock()
+
+    def __getitem__(self, id):
+        schema = self.schemas[id]
+        if schema is UNLOADED:
+            with self.lock:
+                schema = self.schemas[id]
+                if schema is UNLOADED:
+                    schema = self.schemas[id] = self.load(id)
+        return schema
+
+    def __iter__(self):
+        if self.load is None:
+            return iter(self.schemas)
+        return (self[id] for id in range(len(self.schemas)))
+
+    def __len__(self):
+        return len(self.schemas)
+
+    def __setitem__(self, id, schema):
+        self.schemas[id] = schema
+
+    def append(self, schema):
+        self.schemas.append(schema)
+
+    def get_ids(self):
+        return [id for id, schema in enumerate(self.schemas) if schema is not None]
+
+    def reserve(self, count, load):
+        self.schemas.extend([UNLOADED] * count)
+        self.load = load
 
 
 class Struct:
-    def __init__(self, lines):
-        self.lines = lines
-        self._set_schemas()
-        self._sanitize()
-        self._set_relationships()
+    def __init__(self, schemas, linked=False, diagnostics=None):
+        self.id_schema_map = SchemaTable()
+        self.name_schema_map = SchemaMap(self.id_schema_map)
+        self.graph = Graph(self.id_schema_map)
+        self.missing_parent_map = dict()
+        self.family_cache = LRUCache()
+        self.search_index = None
+        self.cycle = list()
+        self.diagnostics = list() if diagnostics is None else diagnostics
+        for schema in schemas:
+            self._index(schema)
+        if not linked:
+            self._set_relationships()
+            self._set_levels()
+
+    @property
+    def schemas(self):
+        return self.name_schema_map.values()
+
+    def add_schema(self, schema):
+        if schema.name in self.name_schema_map:
+            raise ValueError('DuplicateHeader: ' + schema.name)
+        self.family_cache.clear()
+        if self.search_index is not None:
+            self.search_index.add(schema.name)
+        self._index(schema)
+        parent_ids = self._get_parent_ids(schema)
+        self.graph.set_parent_ids(schema.id, parent_ids)
+        for parent_id in parent_ids:
+            self.graph.set_child_ids(parent_id, list(self.graph.get_child_ids(parent_id)) + [schema.id])
+        child_ids = list()
+        for child in self.missing_parent_map.pop(schema.name, list()):
+            self.graph.set_parent_ids(child.id, self._get_parent_ids(child, record_missing=False))
+            child_ids.append(child.id)
+        self.graph.set_child_ids(schema.id, child_ids)
+        self._update_levels([schema.id, *child_ids], [schema.id, *parent_ids])
+        return schema
+
+    def add_unloaded_schemas(self, names, load):
+        start = len(self.id_schema_map)
+        self.name_schema_map.add_ids(names, range(start, start + len(names)))
+        self.id_schema_map.reserve(len(names), lambda id: self._load(id, load(id - start)))
 
     def get_family_by_schema(self, schema):
-        members = list()
-        members.append(schema)
-        self._get_children_by_schema(schema, members)
-        self._get_parents_by_schema(schema, members)
-        return Family(members)
+        family = self.family_cache.get(schema.id)
+        if family is None:
+            family = self.family_cache.put(schema.id, FamilyView(schema))
+        return family
 
-    def get_schema_by_name(self, name):
-        for schema in self.schemas:
-            if schema.name == name:
-                return schema
-
-    def _get_children_by_schema(self, schema, family):
-        for child in schema.children:
-            if child not in family:
-                family.append(child)
-                self._get_children_by_schema(schema=child, family=family)
-
-    def _get_parents_by_schema(self, schema, family):
-        for parent in schema.parents:
-            if parent not in family:
-                family.append(parent)
-                self._get_parents_by_schema(schema=parent, family=family)
-
-    def _set_schemas(self):
-        schemas = self._get_schemas_from_lines()
-        [schema.move_types() for schema in schemas]
-        self.schemas = schemas
+    def get_id_by_name(self, name):
+        return self.name_schema_map.get_id(name)
 
-    def _get_schemas_from_lines(self):
-        schemas = list()
-        schema = None
-        key = str()
+    def get_schema_by_id(self, id):
+        if 0 <= id < len(self.id_schema_map):
+            return self.id_schema_map[id]
 
-        for line in self.lines:
-            if line[:len('obj-schema')] == 'obj-schema':
-                schema = Schema(name=line[line.find('('):])
-                schemas.append(schema)
+    def get_schema_by_name(self, name):
+        return self.name_schema_map.get(name)
 
-            elif line[:1] == ':':
-                key = line[1:]
-                schema.descriptions[key] = list()
+    def get_search_index(self):
+        if self.search_index is None:
+            self.search_index = SearchIndex(self.name_schema_map)
+        return self.search_index
 
-            else:
-                if line[:1] in {'!', '?'}:
-                    schema.descriptions[key].append(line[line.find('('):])
-                else:
-                    schema.descriptions[key].append(line)
+    def remove_schema(self, schema):
+        self.family_cache.clear()
+        if self.search_index is not None:
+            self.search_index.remove(schema.name)
+        del self.name_schema_map[schema.name]
+        self.id_schema_map[schema.id] = None
+        self._remove_missing_parents(schema)
+        parent_ids = set(schema.get_parent_ids())
+        child_ids = list(schema.get_child_ids())
+        for parent_id in parent_ids:
+            self.graph.set_child_ids(parent_id, [id for id in self.graph.get_child_ids(parent_id) if id != schema.id])
+        for child_id in child_ids:
+            self.graph.set_parent_ids(child_id, [id for id in self.graph.get_parent_ids(child_id) if id != schema.id])
+            self.missing_parent_map.setdefault(schema.name, list()).append(self.id_schema_map[child_id])
+        self.graph.set_parent_ids(schema.id, list())
+        self.graph.set_child_ids(schema.id, list())
+        schema.graph = None
+        self._update_levels(child_ids, parent_ids)
 
-        return schemas
+    def update_schema(self, schema, types):
+        self.family_cache.clear()
+        self._remove_missing_parents(schema)
+        old_parent_ids = set(schema.get_parent_ids())
+        schema.types = types
+        parent_ids = self._get_parent_ids(schema)
+        self.graph.set_parent_ids(schema.id, parent_ids)
+        for parent_id in old_parent_ids | set(parent_ids):
+            child_ids = [id for id in self.graph.get_child_ids(parent_id) if id != schema.id]
+            self.graph.set_child_ids(parent_id, child_ids + [schema.id] * parent_ids.count(parent_id))
+        self._update_levels([schema.id], old_parent_ids | set(parent_ids))
+        return schema
 
-    def _sanitize(self):
-        self._sanitize_duplicate_header()
-        self._sanitize_no_header()
-        self._sanitize_duplicate_id()
+    def _get_parent_ids(self, schema, record_missing=True):
+        parent_ids = list()
+        ids = self.name_schema_map.ids
+        for parent_name in schema.get_parent_names_from_types():
+            parent_id = ids.get(parent_name)
+            if parent_id is not None:
+                parent_ids.append(parent_id)
+            elif record_missing:
+                self.missing_parent_map.setdefault(parent_name, list()).append(schema)
+        return parent_ids
 
-    def _sanitize_duplicate_header(self):
-        names = set()
-        for schema in self.schemas:
-            if schema.name in names:
-                msg = 'DuplicateHeader: ' + schema.name
-                Logger.error(msg)
-                sys.exit(1)
-            else:
-                names.add(schema.name)
+    def _remove_missing_parents(self, schema):
+        for parent_name in schema.get_parent_names_from_types():
+            if parent_name in self.missing_parent_map:
+                orphans = self.missing_parent_map[parent_name]
+                orphans[:] = [orphan for orphan in orphans if orphan is not schema]
+                if not orphans:
+                    del self.missing_parent_map[parent_name]
 
-    def _sanitize_duplicate_id(self):
-        header = str()
-        ids = set()
-        for line in self.lines:
-            if line[:len('obj-schema')] == 'obj-schema':
-                header = line[line.find('('):]
-                ids = set()
-            elif line[:1] in {'!', '?'}:
-                uid = line[1:line.find(' ')]
-                if uid in ids:
-                    msg = 'DuplicateID: ' + header + ' ' + uid
-                    Logger.warning(msg)
-                else:
-                    ids.add(uid)
+    def _index(self, schema):
+        schema.id = len(self.id_schema_map)
+        schema.graph = self.graph
+        self.id_schema_map.append(schema)
+        self.name_schema_map[schema.name] = schema
+
+    def _load(self, id, schema):
+        schema.id = id
+        schema.graph = self.graph
+        return schema
 
-    def _sanitize_no_header(self):
-        headers = set([schema.name for schema in self.schemas])
+    @measure('levels')
+    def _set_levels(self):
+        ids = [schema.id for schema in self.schemas]
+        topology = Topology(ids, self.graph.get_parent_ids, self.graph.get_child_ids)
+        depths = topology.get_depths()
+        self.graph.reachability = Reachability(self.graph, Reachability.get_ranks(depths, len(self.id_schema_map)))
+        self.cycle = [self.id_schema_map[id].name for id in topology.cycle]
+        heights = topology.get_heights()
         for schema in self.schemas:
-            blood_type = schema.name[schema.name.find('?'): schema.name.find(' ')]
-            for type in schema.types:
-                if type[type.find('?'): type.find(' ')] == blood_type:
-                    if type not in headers:
-                        msg = 'HeaderNotFound: ' + type
-                        Logger.warning(msg)
+            schema.depth = depths.get(schema.id, 0)
+            schema.height = heights.get(schema.id, 0)
 
+    @measure('link')
     def _set_relationships(self):
-        for schema in self.schemas:
-            parent_names = schema.get_parent_names_from_types()
-            for parent_name in parent_names:
-                for potential_parent in self.schemas:
-                    if potential_parent.name == parent_name:
-                        schema.parents.append(potential_parent)
-                        potential_parent.children.append(schema)
-                        break
-
-
-class Family:
-    def __init__(self, members):
-        self.members = [member.copy() for member in members]
-        self._set_relationships()
-        self._find_depth()
-        self._find_height()
-        self._sort()
+        parent_offsets = array.array('i', [0])
+        parent_indices = array.array('i')
+        for schema in self.id_schema_map:
+            parent_indices.extend(self._get_parent_ids(schema))
+            parent_offsets.append(len(parent_indices))
+        self.graph.set_edges(parent_offsets, parent_indices)
+
+    def _update_levels(self, depth_ids, height_ids):
+        if self.cycle:
+            self._set_levels()
+            return
+        reachability = self.graph.get_reachability()
+        budget = 2 * len(self.id_schema_map)
+        passes = (
+            ('depth', depth_ids, self.graph.get_parent_ids, self.graph.get_child_ids),
+            ('height', height_ids, self.graph.get_child_ids, self.graph.get_parent_ids),
+        )
+        for attribute, ids, get_relative_ids, get_dependent_ids in passes:
+            queue = collections.deque(ids)
+            while queue:
+                budget -= 1
+                if budget < 0:
+                    self._set_levels()
+                    return
+                schema = self.id_schema_map[queue.popleft()]
+                if schema is None:
+                    continue
+                level = max([getattr(self.id_schema_map[id], attribute) + 1 for id in get_relative_ids(schema.id)], default=0)
+                if attribute == 'depth':
+                    reachability.set_rank(schema.id, level)
+                if level != getattr(schema, attribute):
+                    setattr(schema, attribute, level)
+                    queue.extend(get_dependent_ids(schema.id))
+
+
+class FamilyView:
+    @measure('family')
+    def __init__(self, schema):
+        self.schema = schema
+        self.nodes = self._get_nodes(schema)
+        self.positions = {node.id: position for position, node in enumerate(self.nodes)}
+        self.parents = [self._get_positions(node.get_parent_ids()) for node in self.nodes]
+        self.children = [sorted(self._get_positions(node.get_child_ids())) for node in self.nodes]
+        self.depths = list()
+        self.heights = list()
+        self._find_levels()
+        self.order = self._sort()
+        self.members = [self.nodes[position] for position in self.order]
+
+    def get_children(self, member):
+        return [self.nodes[position] for position in self.children[self.positions[member.id]]]
+
+    def get_depth(self, member):
+        return self.depths[self.positions[member.id]]
+
+    def get_height(self, member):
+        return self.heights[self.positions[member.id]]
+
+    def get_edges(self):
+        descendant_count = 1 + len(self.schema.get_descendant_ids())
+        edges = dict()
+        for position in range(descendant_count):
+            edges.update(((position, child), None) for child in self.children[position])
+        for position in [0, *range(descendant_count, len(self.nodes))]:
+            edges.update(((parent, position), None) for parent in self.parents[position])
+        return [(self.nodes[parent], self.nodes[child]) for parent, child in edges]
 
     def get_max_depth(self):
-        max = 0
-        for member in self.members:
-            if member.depth > max:
-                max = member.depth
-        return max
+        return max(self.depths)
 
-    def _find_depth(self):
-        for member in self.members:
-            member.find_depth()
+    def get_parents(self, member):
+        return [self.nodes[position] for position in self.parents[self.positions[member.id]]]
 
-    def _find_height(self):
-        for member in self.members:
-            member.find_height()
+    def _find_levels(self):
+        topology = Topology(range(len(self.nodes)), self.parents.__getitem__, self.children.__getitem__)
+        if topology.cycle:
+            raise CycleError([self.nodes[position].name for position in topology.cycle])
+        depths = topology.get_depths()
+        heights = topology.get_heights()
+        self.depths = [depths[position] for position in range(len(self.nodes))]
+        self.heights = [heights[position] for position in range(len(self.nodes))]
 
-    def _group_by_depth(self, members):
+    def _get_nodes(self, schema):
+        ids = dict.fromkeys([schema.id, *schema.get_descendant_ids(), *schema.get_ancestor_ids()])
+        return [schema.graph.nodes[id] for id in ids]
+
+    def _get_positions(self, relative_ids):
+        return [self.positions[id] for id in relative_ids if id in self.positions]
+
+    def _get_median_rank(self, position, ranks):
+        depth = self.depths[position] - 1
+        parent_ranks = sorted([ranks[parent] for parent in self.parents[position] if self.depths[parent] == depth])
+        return parent_ranks[(len(parent_ranks) - 1) // 2], sum(parent_ranks) / len(parent_ranks)
+
+    def _group_by_depth(self, positions):
         depth = -1
         groups = list()
 
-        for member in members:
-            if member.depth != depth:
-                depth = member.depth
+        for position in positions:
+            if self.depths[position] != depth:
+                depth = self.depths[position]
                 groups.append(list())
-            groups[-1].append(member)
+            groups[-1].append(position)
 
         return groups
 
-    def _set_relationships(self):
-        for member in self.members:
-            parent_names = member.get_parent_names_from_types()
-            for parent_name in parent_names:
-                for potential_parent in self.members:
-                    if potential_parent.name == parent_name:
-                        member.parents.append(potential_parent)
-                        potential_parent.children.append(member)
-                        break
-
+    @measure('family.sort')
     def _sort(self):
-        sorted_members = self._sort_by_depth(self.members)
-        sorted_groups = self._group_by_depth(sorted_members)
-        sorted_groups = [self._sort_by_height(group) for group in sorted_groups]
-        sorted_groups = self._sort_by_ancestor(list(reversed(sorted_groups)))
-
-        self.members = list()
-        for siblings in sorted_groups:
-            for member in siblings:
-                if member not in self.members:
-                    self.members.append(member)
-
-    def _sort_by_ancestor(self, groups):
-        for i in range(len(groups)):
-            if i and i != len(groups) - 1:
-                members = groups[i]
-                if len(members) >= 2:
-                    sorted_members = self._sort_by_parent(members)
-                    if members != sorted_members:
-                        groups[i][:] = sorted_members
-                        self._update_descendants(parents=sorted_members, child_groups=groups[i+1:])
-        return groups
+        positions = sorted(range(len(self.nodes)), key=lambda position: (self.depths[position], -self.heights[position]))
+        ranks = [0] * len(self.nodes)
+        order = list()
+        for group in self._group_by_depth(positions):
+            if order:
+                group.sort(key=lambda position: self._get_median_rank(position, ranks))
+            for position in group:
+                ranks[position] = len(order)
+                order.append(position)
+        return order
 
-    def _sort_by_depth(self, members):
-        sorted_members = list()
-        for member in members:
-            if not sorted_members:
-                sorted_members.append(member)
-            else:
-                for i in range(len(sorted_members)):
-                    if member.depth >= sorted_members[i].depth:
-                        sorted_members.insert(i, member)
-                        break
-                if member not in sorted_members:
-                    sorted_members.append(member)
-        return sorted_members
-
-    def _sort_by_height(self, members):
-        sorted_members = list()
-        for member in members:
-            if not sorted_members:
-                sorted_members.append(member)
-            else:
-                for i in range(len(sorted_members)):
-                    if member.height >= sorted_members[i].height:
-                        sorted_members.insert(i, member)
-                        break
-                if member not in sorted_members:
-                    sorted_members.append(member)
-        return sorted_members
-
-    def _sort_by_parent(self, members):
-        parent_name_member_dict = dict()
-        for member in members:
-            for parent_name in member.get_parent_names():
-                if parent_name in parent_name_member_dict:
-                    parent_name_member_dict[parent_name].append(member)
-                else:
-                    parent_name_member_dict[parent_name] = [member]
-        return [member for children in parent_name_member_dict.values() for member in children]
-
-    def _update_descendants(self, parents, child_groups):
-        descendant_names = [name for member in parents for name in member.get_descendant_names()]
-        descendant_names = list(dict.fromkeys(descendant_names))
-        for child_group in child_groups:
-            child_names = [child.name for child in child_group]
-            ordered_child_group = list()
-            for descendant_name in descendant_names:
-                if descendant_name in child_names:
-                    idx = child_names.index(descendant_name)
-                    ordered_child_group.append(child_group[idx])
-                    del child_group[idx]
-                    del child_names[idx]
-            child_group[:] = ordered_child_group
+
+class LRUCache:
+    def __init__(self, maxsize=32):
+        self.maxsize = maxsize
+        self.items = collections.OrderedDict()
+
+    def clear(self):
+        self.items.clear()
+
+    def get(self, key):
+        if key in self.items:
+            self.items.move_to_end(key)
+            return self.items[key]
+
+    def put(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+        if len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+        return value
+
+
+class Reachability:
+    def __init__(self, graph, ranks=None, maxsize=1024):
+        self.graph = graph
+        self.ranks = ranks
+        self.ancestor_cache = LRUCache(maxsize)
+        self.descendant_cache = LRUCache(maxsize)
+        self.pre = None
+        self.post = None
+        self.low = None
+
+    def clear(self):
+        self.ancestor_cache.clear()
+        self.descendant_cache.clear()
+        self.pre = None
+        self.post = None
+        self.low = None
+
+    def get_ancestor_ids(self, id):
+        return self._get_reachable(id, self.graph.get_parent_ids, self.ancestor_cache)[0]
+
+    @staticmethod
+    def get_ranks(depths, count):
+        ranks = array.array('i', [-1]) * count
+        for id, depth in depths.items():
+            ranks[id] = depth
+        return ranks
+
+    def get_descendant_ids(self, id):
+        return self._get_reachable(id, self.graph.get_child_ids, self.descendant_cache)[0]
+
+    def is_ancestor(self, ancestor_id, id):
+        if self.ranks is None:
+            self._set_ranks()
+        ancestor_rank, rank = self._get_rank(ancestor_id), self._get_rank(id)
+        if ancestor_id == id or (ancestor_rank >= 0 and rank >= 0 and ancestor_rank >= rank):
+            return False
+        descendants = self.descendant_cache.get(ancestor_id)
+        if descendants is not None:
+            return id in descendants[1]
+        ancestors = self.ancestor_cache.get(id)
+        if ancestors is not None:
+            return ancestor_id in ancestors[1]
+        if self.post is None:
+            self._set_labels()
+        if not self.post:
+            return ancestor_id in self._get_reachable(id, self.graph.get_parent_ids, self.ancestor_cache)[1]
+        if self._is_tree_ancestor(ancestor_id, id):
+            return True
+        if not self._may_reach(ancestor_id, id):
+            return False
+        visited = {id}
+        stack = [id]
+        while stack:
+            for parent_id in self.graph.get_parent_ids(stack.pop()):
+                if parent_id == ancestor_id:
+                    return True
+                if parent_id in visited or self.ranks[parent_id] <= ancestor_rank or not self._may_reach(ancestor_id, parent_id):
+                    continue
+                if self._is_tree_ancestor(ancestor_id, parent_id):
+                    return True
+                visited.add(parent_id)
+                stack.append(parent_id)
+        return False
+
+    def set_rank(self, id, rank):
+        if self.ranks is None:
+            return
+        if id >= len(self.ranks):
+            self.ranks.extend([-1] * (id + 1 - len(self.ranks)))
+        if self.ranks[id] != rank:
+            self.pre = self.post = self.low = None
+        self.ranks[id] = rank
+
+    def _get_rank(self, id):
+        return self.ranks[id] if id < len(self.ranks) else -1
+
+    @measure('reachability')
+    def _get_reachable(self, id, get_relative_ids, cache):
+        reachable = cache.get(id)
+        if reachable is None:
+            ids = list()
+            visited = {id}
+            stack = [iter(get_relative_ids(id))]
+            while stack:
+                relative_id = next(stack[-1], None)
+                if relative_id is None:
+                    stack.pop()
+                elif relative_id not in visited:
+                    visited.add(relative_id)
+                    ids.append(relative_id)
+                    stack.append(iter(get_relative_ids(relative_id)))
+            reachable = cache.put(id, (tuple(ids), frozenset(ids)))
+        return reachable
+
+    def _is_tree_ancestor(self, ancestor_id, id):
+        return self.pre[ancestor_id] <= self.pre[id] and self.post[id] <= self.post[ancestor_id]
+
+    def _may_reach(self, ancestor_id, id):
+        return self.low[ancestor_id] <= self.low[id] and self.post[id] <= self.post[ancestor_id]
+
+    @measure('reachability.labels')
+    def _set_labels(self):
+        count = len(self.graph.nodes)
+        ids = self.graph.get_ids()
+        self.pre, self.post, self.low = array.array('i'), array.array('i'), array.array('i')
+        if any(self._get_rank(id) < 0 for id in ids):
+            return
+        order = sorted(ids, key=self.ranks.__getitem__)
+        pre = array.array('i', [-1]) * count
+        post = array.array('i', [-1]) * count
+        visits = 0
+        finishes = 0
+        for root in order:
+            if pre[root] >= 0:
+                continue
+            pre[root] = visits
+            visits += 1
+            stack = [(root, iter(self.graph.get_child_ids(root)))]
+            while stack:
+                child_id = next(stack[-1][1], None)
+                if child_id is None:
+                    post[stack.pop()[0]] = finishes
+                    finishes += 1
+                elif pre[child_id] < 0:
+                    pre[child_id] = visits
+                    visits += 1
+                    stack.append((child_id, iter(self.graph.get_child_ids(child_id))))
+        low = array.array('i', post)
+        for id in reversed(order):
+            for child_id in self.graph.get_child_ids(id):
+                if low[child_id] < low[id]:
+                    low[id] = low[child_id]
+        self.pre, self.post, self.low = pre, post, low
+
+    @measure('reachability.ranks')
+    def _set_ranks(self):
+        depths = Topology(self.graph.get_ids(), self.graph.get_parent_ids, self.graph.get_child_ids).get_depths()
+        self.ranks = self.get_ranks(depths, len(self.graph.nodes))
+
+
+class SearchIndex:
+    @measure('search.index')
+    def __init__(self, names, gram_size=3):
+        self.names = sorted(names)
+        self.keys = [name.lower() for name in self.names]
+        self.gram_size = gram_size
+        self.grams = dict()
+        self.tokens = dict()
+        for rank, key in enumerate(self.keys):
+            for gram in {key[i:i + gram_size] for i in range(len(key) - gram_size + 1)}:
+                self.grams.setdefault(gram, array.array('i')).append(rank)
+            for token in set(self._get_tokens(key)):
+                self.tokens.setdefault(token, array.array('i')).append(rank)
+        self.token_list = sorted(self.tokens)
+        short_keys = sorted((self._get_short_key(key), rank) for rank, key in enumerate(self.keys))
+        self.short_keys = [short_key for short_key, _ in short_keys]
+        self.short_key_ranks = array.array('i', [rank for _, rank in short_keys])
+        self.last_query = None
+        self.last_ranks = None
+        self.added = list()
+        self.removed = set()
+
+    def add(self, name):
+        rank = self._get_rank(name)
+        if rank is not None and rank in self.removed:
+            self.removed.discard(rank)
+        elif rank is None:
+            bisect.insort(self.added, name)
+
+    def get_ranks(self, query, mode='substring'):
+        query = query.lower()
+        if mode == 'prefix':
+            low = bisect.bisect_left(self.short_keys, query)
+            high = bisect.bisect_left(self.short_keys, query + '\U0010ffff')
+            return self.short_key_ranks[low:high]
+        if mode == 'token':
+            ranks = None
+            for token in self._get_tokens(query):
+                low = bisect.bisect_left(self.token_list, token)
+                high = bisect.bisect_left(self.token_list, token + '\U0010ffff')
+                matches = {rank for token in self.token_list[low:high] for rank in self.tokens[token]}
+                ranks = matches if ranks is None else ranks & matches
+            return list(ranks or ())
+        return self._get_substring_ranks(query)
+
+    def remove(self, name):
+        rank = self._get_rank(name)
+        if rank is not None:
+            self.removed.add(rank)
+            return
+        index = bisect.bisect_left(self.added, name)
+        if index < len(self.added) and self.added[index] == name:
+            del self.added[index]
+
+    @classmethod
+    @measure('search.scan')
+    def scan(cls, names, query, mode='substring', limit=None, offset=0):
+        match = cls._get_matcher(query.lower(), mode)
+        names = [name for name in names if match(name.lower())]
+        if limit is not None:
+            return heapq.nsmallest(offset + limit, names)[offset:]
+        return sorted(names)[offset:]
+
+    @measure('search')
+    def search(self, query, mode='substring', limit=None, offset=0):
+        ranks = self.get_ranks(query, mode)
+        if self.added or self.removed:
+            ranks = ranks if mode == 'substring' else sorted(ranks)
+            names = (self.names[rank] for rank in ranks if rank not in self.removed)
+            match = self._get_matcher(query.lower(), mode)
+            added = [name for name in self.added if match(name.lower())]
+            return list(itertools.islice(heapq.merge(names, added), offset, None if limit is None else offset + limit))
+        if mode == 'substring':
+            ranks = ranks[offset:offset + limit] if limit is not None else ranks[offset:]
+        elif limit is not None:
+            ranks = heapq.nsmallest(offset + limit, ranks)[offset:]
+        else:
+            ranks = sorted(ranks)[offset:]
+        return [self.names[rank] for rank in ranks]
+
+    @classmethod
+    def _get_matcher(cls, query, mode):
+        if mode == 'prefix':
+            return lambda key: cls._get_short_key(key).startswith(query)
+        if mode == 'token':
+            patterns = [re.compile('(?:^|[^0-9a-z])' + token) for token in cls._get_tokens(query)]
+            return lambda key: bool(patterns) and all(pattern.search(key) for pattern in patterns)
+        return lambda key: query in key
+
+    def _get_rank(self, name):
+        rank = bisect.bisect_left(self.names, name)
+        if rank < len(self.names) and self.names[rank] == name:
+            return rank
+
+    @staticmethod
+    def _get_short_key(key):
+        return key[key.find(' ') + 1:]
+
+    def _get_substring_ranks(self, query):
+        if query == self.last_query:
+            return self.last_ranks
+        if self.last_query is not None and self.last_query in query:
+            candidates = self.last_ranks
+        elif len(query) >= self.gram_size:
+            postings = [self.grams.get(query[i:i + self.gram_size], ()) for i in range(len(query) - self.gram_size + 1)]
+            candidates = min(postings, key=len)
+        else:
+            candidates = range(len(self.keys))
+        ranks = array.array('i', [rank for rank in candidates if query in self.keys[rank]])
+        self.last_query = query
+        self.last_ranks = ranks
+        return ranks
+
+    @staticmethod
+    def _get_tokens(key):
+        return [token for token in TOKEN_SEPARATOR.split(key) if token]
+
+
+class Topology:
+    def __init__(self, nodes, get_parents, get_children):
+        self.get_parents = get_parents
+        self.get_children = get_children
+        self.order = list()
+        self.cycle = list()
+        self._sort(nodes)
+
+    def get_depths(self):
+        depths = dict()
+        for node in self.order:
+            depths[node] = max([depths[parent] + 1 for parent in self.get_parents(node)], default=0)
+        return depths
+
+    def get_heights(self):
+        heights = dict()
+        for node in reversed(self.order):
+            heights[node] = max([heights[child] + 1 for child in self.get_children(node) if child in heights], default=0)
+        return heights
+
+    def _find_cycle(self, remaining):
+        node = next(iter(remaining))
+        steps = dict()
+        path = list()
+        while node not in steps:
+            steps[node] = len(path)
+            path.append(node)
+            node = next(parent for parent in self.get_parents(node) if parent in remaining)
+        return list(reversed(path[steps[node]:]))
+
+    def _sort(self, nodes):
+        in_degrees = {node: len(self.get_parents(node)) for node in nodes}
+        queue = collections.deque([node for node, in_degree in in_degrees.items() if not in_degree])
+        while queue:
+            node = queue.popleft()
+            self.order.append(node)
+            for child in self.get_children(node):
+                in_degrees[child] -= 1
+                if not in_degrees[child]:
+                    queue.append(child)
+        if len(self.order) < len(in_degrees):
+            remaining = {node for node, in_degree in in_degrees.items() if in_degree}
+            self.cycle = self._find_cycle(remaining)
@@ -0,0 +1,177 @@
+import asyncio, http, json, logging, urllib.parse
+
+from instrument import measure
+from schema import *
+
+
+logger = logging.getLogger(__name__)
+
+CACHED_ROUTES = {'/ancestors', '/descendants', '/family'}
+SEARCH_MODES = {'substring', 'prefix', 'token'}
+MAX_BODY_SIZE = 1 << 24
+
+
+class Server:
+    def __init__(self, struct, host='127.0.0.1', port=8000, cache_size=1024):
+        self.struct = struct
+        self.host = host
+        self.port = port
+        self.responses = LRUCache(cache_size)
+        self.routes = {
+            '/ancestors': self._get_ancestors,
+            '/descendants': self._get_descendants,
+            '/descriptions': self._get_descriptions,
+            '/family': self._get_family,
+            '/schema': self._get_schema,
+            '/search': self._search,
+        }
+
+    @measure('server.handle')
+    def handle(self, path, params):
+        route = self.routes.get(path)
+        if route is None:
+            return 404, self._get_error('RouteNotFound: ' + path)
+        key = (path, params.get('name'))
+        if path in CACHED_ROUTES:
+            response = self.responses.get(key)
+            if response is not None:
+                return response
+        try:
+            response = 200, json.dumps(route(params)).encode()
+        except KeyError as error:
+            if error.args[0] == 'name':
+                return 400, self._get_error('MissingParameter: name')
+            return 404, self._get_error(error.args[0])
+        except ValueError as error:
+            return 400, self._get_error('InvalidParameter: ' + str(error))
+        except CycleError as error:
+            return 409, self._get_error(str(error))
+        if path in CACHED_ROUTES:
+            self.responses.put(key, response)
+        return response
+
+    def handle_batch(self, body):
+        try:
+            requests = json.loads(body)
+            if not isinstance(requests, list) or not all(isinstance(request, dict) for request in requests):
+                raise ValueError('expected a list of objects')
+        except ValueError as error:
+            return 400, self._get_error('InvalidBatch: ' + str(error))
+        responses = list()
+        for request in requests:
+            path = request.get('path', '')
+            params = request.get('params') or dict()
+            if not isinstance(path, str):
+                status, payload = 400, self._get_error('InvalidParameter: path')
+            elif not isinstance(params, dict):
+                status, payload = 400, self._get_error('InvalidParameter: params')
+            else:
+                status, payload = self.handle(path, {key: str(value) for key, value in params.items()})
+            responses.append(b'{"status":' + str(status).encode() + b',"body":' + payload + b'}')
+        return 200, b'[' + b','.join(responses) + b']'
+
+    def run(self):
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        logger.info('Serving: http://' + self.host + ':' + str(self.port))
+        async with server:
+            await server.serve_forever()
+
+    def _dispatch(self, method, target, body):
+        url = urllib.parse.urlsplit(target)
+        if url.path == '/batch':
+            if method != 'POST':
+                return 405, self._get_error('MethodNotAllowed: ' + method)
+            return self.handle_batch(body)
+        if method != 'GET':
+            return 405, self._get_error('MethodNotAllowed: ' + method)
+        return self.handle(url.path, dict(urllib.parse.parse_qsl(url.query)))
+
+    def _get_ancestors(self, params):
+        return self._get_schema_by_name(params).get_ancestor_names()
+
+    def _get_descendants(self, params):
+        return self._get_schema_by_name(params).get_descendant_names()
+
+    def _get_descriptions(self, params):
+        return self._get_schema_by_name(params).descriptions
+
+    def _get_error(self, message):
+        return json.dumps({'error': message}).encode()
+
+    def _get_family(self, params):
+        family = self.struct.get_family_by_schema(self._get_schema_by_name(params))
+        return [
+            {'name': member.name, 'depth': family.get_depth(member), 'height': family.get_height(member)}
+            for member in family.members
+        ]
+
+    def _get_response(self, status, payload, keep_alive):
+        head = 'HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\nConnection: %s\r\n\r\n' % (
+            status, http.HTTPStatus(status).phrase, len(payload), 'keep-alive' if keep_alive else 'close')
+        return head.encode() + payload
+
+    def _get_schema(self, params):
+        schema = self._get_schema_by_name(params)
+        store = schema.description_store
+        return {
+            'name': schema.name,
+            'types': schema.types,
+            'parents': schema.get_parent_names(),
+            'children': [child.name for child in schema.children],
+            'depth': schema.depth,
+            'height': schema.height,
+            'location': store.get_location(schema.description_index) if store is not None else None,
+        }
+
+    def _get_schema_by_name(self, params):
+        schema = self.struct.get_schema_by_name(params['name'])
+        if schema is None:
+            raise KeyError('SchemaNotFound: ' + params['name'])
+        return schema
+
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError):
+                    break
+                request_line, *header_lines = head[:-4].decode('latin-1').split('\r\n')
+                headers = dict()
+                for line in header_lines:
+                    key, _, value = line.partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                try:
+                    method, target, version = request_line.split(' ')
+                    length = int(headers.get('content-length', 0))
+                    if not 0 <= length <= MAX_BODY_SIZE:
+                        raise ValueError(length)
+                except ValueError:
+                    writer.write(self._get_response(400, self._get_error('InvalidRequest: ' + request_line), False))
+                    break
+                body = await reader.readexactly(length)
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection == 'keep-alive' or (version == 'HTTP/1.1' and connection != 'close')
+                writer.write(self._get_response(*self._dispatch(method, target, body), keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    def _search(self, params):
+        limit = params.get('limit')
+        mode = params.get('mode', 'substring')
+        if mode not in SEARCH_MODES:
+            raise ValueError('mode ' + mode)
+        limit = int(limit) if limit else None
+        offset = int(params.get('offset', 0))
+        if (limit is not None and limit < 0) or offset < 0:
+            raise ValueError('limit and offset must not be negative')
+        index = self.struct.get_search_index()
+        return index.search(params.get('q', ''), mode, limit, offset)
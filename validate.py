@@ -0,0 +1,120 @@
+import collections
+
+from instrument import measure
+from schema import *
+
+
+class Validator:
+    def __init__(self, struct):
+        self.struct = struct
+        self.diagnostics = list()
+
+    def get_report(self):
+        counts = collections.Counter(diagnostic.severity for diagnostic in self.diagnostics)
+        return {
+            'schemas': len(self.struct.schemas),
+            'errors': counts[ERROR],
+            'warnings': counts[WARNING],
+            'diagnostics': [diagnostic.to_dict() for diagnostic in self.diagnostics],
+        }
+
+    def get_summary(self):
+        report = self.get_report()
+        return str(report['errors']) + ' errors, ' + str(report['warnings']) + ' warnings'
+
+    @measure('validate')
+    def run(self):
+        self.diagnostics = list(self.struct.diagnostics)
+        self._check_missing_headers()
+        self._check_cycles()
+        self._check_orphans()
+        self._set_locations()
+        return self.diagnostics
+
+    def _check_cycles(self):
+        if not self.struct.cycle:
+            return
+        graph = self.struct.graph
+        ids = [schema.id for schema in self.struct.schemas]
+        remaining = set(ids) - set(Topology(ids, graph.get_parent_ids, graph.get_child_ids).order)
+        for component in self._get_components(remaining):
+            members = set(component)
+            get_parents = lambda id: [parent for parent in graph.get_parent_ids(id) if parent in members]
+            get_children = lambda id: [child for child in graph.get_child_ids(id) if child in members]
+            if len(component) == 1 and not get_parents(component[0]):
+                continue
+            schemas = [self.struct.get_schema_by_id(id) for id in Topology(component, get_parents, get_children).cycle]
+            names = [schema.name for schema in schemas]
+            self.diagnostics.append(Diagnostic('Cycle', ERROR, names[0], ' -> '.join(names + names[:1]), self._get_sources(schemas)))
+
+    def _check_missing_headers(self):
+        for name, children in self.struct.missing_parent_map.items():
+            for child in children:
+                self.diagnostics.append(Diagnostic('HeaderNotFound', ERROR, child.name, name, self._get_sources([child])))
+
+    def _check_orphans(self):
+        graph = self.struct.graph
+        for schema in self.struct.schemas:
+            if not graph.get_parent_ids(schema.id) and not graph.get_child_ids(schema.id) and not schema.get_parent_names_from_types():
+                self.diagnostics.append(Diagnostic('Orphan', WARNING, schema.name, '', self._get_sources([schema])))
+
+    def _get_components(self, nodes):
+        get_children = lambda id: iter([child for child in self.struct.graph.get_child_ids(id) if child in nodes])
+        indices = dict()
+        low_links = dict()
+        stack = list()
+        components = list()
+        for root in nodes:
+            if root in indices:
+                continue
+            indices[root] = low_links[root] = len(indices)
+            stack.append(root)
+            work = [(root, get_children(root))]
+            while work:
+                node, children = work[-1]
+                for child in children:
+                    if child not in indices:
+                        indices[child] = low_links[child] = len(indices)
+                        stack.append(child)
+                        work.append((child, get_children(child)))
+                        break
+                    if child in low_links:
+                        low_links[node] = min(low_links[node], indices[child])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low_links[parent] = min(low_links[parent], low_links[node])
+                    if low_links[node] == indices[node]:
+                        component = list()
+                        while not component or component[-1] != node:
+                            component.append(stack.pop())
+                            del low_links[component[-1]]
+                        components.append(component)
+        return components
+
+    def _get_sources(self, schemas):
+        return [
+            (schema.description_store, schema.description_store.header_offsets[schema.description_index] if schema.description_store else None)
+            for schema in schemas
+        ]
+
+    def _set_locations(self):
+        offsets = dict()
+        for diagnostic in self.diagnostics:
+            for store, offset in diagnostic.sources:
+                if store is not None:
+                    offsets.setdefault(store, set()).add(offset)
+        locations = dict()
+        for store, store_offsets in offsets.items():
+            store_offsets = sorted(store_offsets)
+            locations.update(((store, offset), location) for offset, location in zip(store_offsets, store.get_locations(store_offsets)))
+        for diagnostic in self.diagnostics:
+            diagnostic.locations = [
+                locations[(store, offset)] if store is not None else '-' if offset is None else '-@' + str(offset)
+                for store, offset in diagnostic.sources
+            ]
+        self.diagnostics.sort(key=lambda diagnostic: (
+            [(str(store.path) if store else '-', store.get_offset(offset) if store else offset or 0) for store, offset in diagnostic.sources],
+            diagnostic.code,
+        ))
@@ -0,0 +1,217 @@
+import array, bisect, contextlib, hashlib, io, logging, mmap, os
+
+from instrument import measure
+from schema import *
+
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 1 << 16
+
+
+class FileChange:
+    def __init__(self, path, stat, first, last, start, end, new_end, virtual_start):
+        self.path = path
+        self.stat = stat
+        self.first = first
+        self.last = last
+        self.start = start
+        self.end = end
+        self.new_end = new_end
+        self.virtual_start = virtual_start
+        self.digests = list()
+        self.schemas = list()
+        self.removed_names = set()
+        self.duplicate_names = set()
+        self.is_full = False
+
+
+class WatchedFile:
+    def __init__(self, path, stat, description_store, schemas, digests):
+        self.path = path
+        self.stat = stat
+        self.description_store = description_store
+        self.headers = array.array('Q', [description_store.header_offsets[schema.description_index] for schema in schemas])
+        self.names = [schema.name for schema in schemas]
+        self.digests = digests
+        self.is_stale = False
+
+
+class Watcher:
+    def __init__(self, paths, struct):
+        self.struct = struct
+        self.files = dict()
+        self.duplicates = dict()
+        file_schemas = dict()
+        for schema in struct.schemas:
+            if schema.description_store is not None:
+                file_schemas.setdefault(schema.description_store.path, list()).append(schema)
+        for path in paths:
+            if path != '-':
+                self.files[path] = self._get_watched_file(path, file_schemas.get(path, list()))
+        for diagnostic in struct.diagnostics:
+            if diagnostic.code == 'DuplicateHeader':
+                paths = {store.path for store, _ in diagnostic.sources if store is not None}
+                self.duplicates.setdefault(diagnostic.name, set()).update(paths & self.files.keys())
+
+    @measure('watch.apply')
+    def apply(self, changes):
+        for change in changes:
+            for name in change.removed_names:
+                schema = self.struct.get_schema_by_name(name)
+                if schema is not None:
+                    self.struct.remove_schema(schema)
+                for path in self.duplicates.get(name, ()):
+                    if path != change.path:
+                        self.files[path].is_stale = True
+            if change.is_full:
+                self._reset_duplicates(change)
+        order = {path: index for index, path in enumerate(self.files)}
+        taken = list()
+        for change in changes:
+            watched = self.files[change.path]
+            store = watched.description_store
+            store.replace(change.start, change.end, change.new_end, change.virtual_start, *change.stat)
+            old_names = set(watched.names[change.first:change.last])
+            headers = array.array('Q')
+            names = list()
+            for schema in change.schemas:
+                existing = self.struct.get_schema_by_name(schema.name)
+                if existing is None:
+                    self.struct.add_schema(schema)
+                elif existing.name in old_names and existing.description_store is store:
+                    if existing.types != schema.types:
+                        self.struct.update_schema(existing, schema.types)
+                    existing.description_store = store
+                    existing.description_index = schema.description_index
+                else:
+                    owner = existing.description_store.path if existing.description_store is not None else '-'
+                    self.duplicates.setdefault(schema.name, set()).update({change.path, owner} & self.files.keys())
+                    if order[change.path] >= order.get(owner, -1):
+                        logger.error('DuplicateHeader: ' + schema.name + ' ' + store.get_location(schema.description_index))
+                        continue
+                    taken.append((self.files[owner], schema.name))
+                    if existing.types != schema.types:
+                        self.struct.update_schema(existing, schema.types)
+                    existing.description_store = store
+                    existing.description_index = schema.description_index
+                headers.append(store.header_offsets[schema.description_index])
+                names.append(schema.name)
+            watched.headers = watched.headers[:change.first] + headers + watched.headers[change.last:]
+            watched.names = watched.names[:change.first] + names + watched.names[change.last:]
+            watched.digests = change.digests
+            watched.stat = change.stat
+            watched.is_stale = False
+        for watched, name in taken:
+            self._remove_name(watched, name)
+        return bool(changes)
+
+    @measure('watch.poll')
+    def poll(self):
+        changes = list()
+        for watched in self.files.values():
+            try:
+                change = self._get_change(watched)
+            except OSError as error:
+                logger.warning('WatchFailed: ' + str(error))
+                continue
+            if change is not None:
+                changes.append(change)
+        return changes
+
+    def _get_change(self, watched):
+        current = os.stat(watched.path)
+        stat = (current.st_size, current.st_mtime_ns)
+        if stat == watched.stat and not watched.is_stale:
+            return None
+        store = watched.description_store
+        size = watched.stat[0]
+        with self._open(watched.path) as buffer:
+            delta = len(buffer) - size
+            pages = 0
+            while not watched.is_stale and pages < len(watched.digests) and self._get_digest(buffer, pages * PAGE_SIZE, min((pages + 1) * PAGE_SIZE, size)) == watched.digests[pages]:
+                pages += 1
+            prefix = min(pages * PAGE_SIZE, size)
+            suffix = size
+            for page in range(len(watched.digests) - 1, pages - 1, -1):
+                start = page * PAGE_SIZE
+                if watched.is_stale or start + delta < prefix or self._get_digest(buffer, start + delta, min(start + PAGE_SIZE, size) + delta) != watched.digests[page]:
+                    break
+                suffix = start
+
+            headers = watched.headers
+            first = max(bisect.bisect_right(headers, prefix, key=store.get_offset) - 2, 0)
+            last = max(bisect.bisect_right(headers, suffix, key=store.get_offset), first)
+            change = self._parse_change(watched, buffer, stat, first, last)
+            if not change.is_full and self._has_duplicates(watched, change):
+                pages = 0
+                change = self._parse_change(watched, buffer, stat, 0, len(headers))
+            change.digests = watched.digests[:pages] + self._get_digests(buffer, pages * PAGE_SIZE)
+        return change
+
+    def _get_digest(self, buffer, start, end):
+        return hashlib.blake2b(buffer[start:end], digest_size=16).digest()
+
+    def _get_digests(self, buffer, start=0):
+        return [self._get_digest(buffer, offset, offset + PAGE_SIZE) for offset in range(start, len(buffer), PAGE_SIZE)]
+
+    def _get_watched_file(self, path, schemas):
+        if schemas:
+            store = schemas[0].description_store
+            schemas.sort(key=lambda schema: store.get_offset(store.header_offsets[schema.description_index]))
+        else:
+            stat = os.stat(path)
+            store = DescriptionStore(path, stat.st_size, stat.st_mtime_ns)
+        with self._open(path) as buffer:
+            stat = os.stat(path)
+            digests = self._get_digests(buffer) if (stat.st_size, stat.st_mtime_ns) == (store.size, store.mtime_ns) else list()
+        return WatchedFile(path, (store.size, store.mtime_ns), store, schemas, digests)
+
+    def _has_duplicates(self, watched, change):
+        old_names = set(watched.names[change.first:change.last])
+        if change.duplicate_names or not old_names.isdisjoint(self.duplicates):
+            return True
+        for schema in change.schemas:
+            if schema.name in self.duplicates or (schema.name not in old_names and self.struct.get_schema_by_name(schema.name) is not None):
+                return True
+        return False
+
+    def _open(self, path):
+        with open(path, 'rb') as infile:
+            if not os.fstat(infile.fileno()).st_size:
+                return contextlib.nullcontext(b'')
+            return mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _parse_change(self, watched, buffer, stat, first, last):
+        store = watched.description_store
+        headers = watched.headers
+        size = watched.stat[0]
+        delta = len(buffer) - size
+        start = store.get_offset(headers[first]) if first else 0
+        end = store.get_offset(headers[last]) if last < len(headers) else size
+        change = FileChange(watched.path, stat, first, last, start, end, end + delta, store.reserve(end + delta - start))
+        change.is_full = first == 0 and last == len(headers)
+        file = File(io.BytesIO(buffer[start:end + delta]), offset=change.virtual_start, description_store=store)
+        change.schemas = list(file.get_schemas())
+        for diagnostic in file.diagnostics:
+            logger.warning(str(diagnostic))
+            if diagnostic.code == 'DuplicateHeader':
+                change.duplicate_names.add(diagnostic.name)
+        change.removed_names = set(watched.names[first:last]) - {schema.name for schema in change.schemas}
+        return change
+
+    def _remove_name(self, watched, name):
+        if name in watched.names:
+            index = watched.names.index(name)
+            del watched.names[index]
+            del watched.headers[index]
+
+    def _reset_duplicates(self, change):
+        names = {schema.name for schema in change.schemas}
+        for name, paths in list(self.duplicates.items()):
+            if change.path in paths and (name not in names or paths == {change.path}):
+                paths.discard(change.path)
+            if not paths:
+                del self.duplicates[name]
+        for name in change.duplicate_names:
+            self.duplicates.setdefault(name, set()).add(change.path)